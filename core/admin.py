@@ -1,10 +1,40 @@
-from django.core.mail import send_mail
-from django.conf import settings
+import json
+
 from django.contrib import admin
 from django import forms
 from django.core.exceptions import ValidationError
-import json
-from .models import Student, Group, Expense, Category, Settlement
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from django.utils import timezone
+from django.utils.html import format_html
+from .models import Student, Group, Expense, Category, Settlement, ReminderJob, RequestProfile
+from .profiling import stats_text
+from .reminders import queue_reminders
+from .splits import split_amount, split_to_json, validate_split
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that uses the planner's row estimate instead of COUNT(*) for
+    unfiltered changelists on large PostgreSQL tables.
+    """
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] > self.estimate_threshold:
+                return int(row[0])
+        return super().count
 
 
 # Custom form for the Expense model with enhanced validation
@@ -15,26 +45,40 @@ class ExpenseForm(forms.ModelForm):
 
     # Adding a custom field for members_split
     members_split = forms.JSONField(required=False, widget=forms.Textarea, initial={})
+    # Weights for proportional splits when members_split is left empty
+    weights = forms.JSONField(required=False, widget=forms.Textarea)
 
     def clean_members_split(self):
         members_split = self.cleaned_data.get('members_split')
 
-        # Check if members_split is a valid JSON object
-        if members_split:
-            try:
-                # Ensure it's a dictionary
-                if not isinstance(members_split, dict):
-                    raise forms.ValidationError("members_split should be a dictionary.")
-
-                # Check if all amounts are positive numbers
-                for member_id, amount in members_split.items():
-                    if not isinstance(amount, (int, float)) or amount <= 0:
-                        raise forms.ValidationError(f"Amount for member {member_id} must be a positive number.")
-
-            except ValueError:
-                raise forms.ValidationError("Invalid JSON format in members_split.")
+        # Ensure it's a dictionary
+        if members_split and not isinstance(members_split, dict):
+            raise forms.ValidationError("members_split should be a dictionary.")
         return members_split
 
+    def clean(self):
+        cleaned_data = super().clean()
+        amount = cleaned_data.get('amount')
+        group = cleaned_data.get('group')
+        split_type = cleaned_data.get('split_type')
+        members_split = cleaned_data.get('members_split')
+        if amount is None or group is None or not split_type or self.has_error('members_split'):
+            return cleaned_data
+
+        # Validate an explicit split, or compute one from the group members
+        try:
+            if members_split:
+                cleaned_data['members_split'] = validate_split(
+                    amount, members_split, group.members.values_list('id', flat=True)
+                )
+            else:
+                split = split_amount(amount, split_type, group.members.values_list('id', flat=True),
+                                     cleaned_data.get('weights'))
+                cleaned_data['members_split'] = split_to_json(split)
+        except ValidationError as e:
+            self.add_error('members_split', e)
+        return cleaned_data
+
 
 @admin.register(Student)
 class StudentAdmin(admin.ModelAdmin):
@@ -54,8 +98,12 @@ class GroupAdmin(admin.ModelAdmin):
 class ExpenseAdmin(admin.ModelAdmin):
     form = ExpenseForm  # Use the custom form
     list_display = ('group', 'payer', 'amount', 'category', 'split_type', 'date', 'members_split')  # Add members_split
-    list_filter = ('split_type', 'date', 'category')
+    list_select_related = ('group', 'payer', 'category')
+    list_filter = ('split_type', 'category')
+    date_hierarchy = 'date'
     search_fields = ('group__name', 'payer__username', 'category__name')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(Category)
@@ -67,32 +115,64 @@ class CategoryAdmin(admin.ModelAdmin):
 @admin.register(Settlement)
 class SettlementAdmin(admin.ModelAdmin):
     list_display = ('payer', 'receiver', 'amount', 'payment_status_display', 'due_date', 'settlement_method')
-    list_filter = ('payment_status', 'due_date', 'settlement_method')
+    list_select_related = ('payer', 'receiver')
+    list_filter = ('payment_status', 'settlement_method')
+    date_hierarchy = 'due_date'
     search_fields = ('payer__username', 'receiver__username', 'settlement_method')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
-    # Action to send reminder email
+    # Action to queue reminder emails
     actions = ['send_reminder']
 
     def send_reminder(self, request, queryset):
-        for settlement in queryset:
-            if not settlement.payment_status:  # Only send reminder if payment is pending
-                subject = 'Payment Reminder from PocketSense'
-                message = f"""
-                    Hi {settlement.receiver.username},
-
-                    This is a reminder to settle the amount of ₹{settlement.amount} owed to {settlement.payer.username} for the expense in group "{settlement.group.name}".
-                    Please make the payment by {settlement.due_date} using your preferred method.
-                    """
-                recipient_list = [settlement.receiver.email]
-                try:
-                    send_mail(
-                        subject,
-                        message,
-                        settings.EMAIL_HOST_USER,
-                        recipient_list,
-                        fail_silently=False,
-                    )
-                    self.message_user(request, f"Reminder sent to {settlement.receiver.username}.")
-                except Exception as e:
-                    self.message_user(request, f"Error sending reminder: {str(e)}")
+        # Only send reminders for pending payments; `manage.py process_reminders` sends them
+        queued = queue_reminders(queryset.filter(payment_status=False).values_list('pk', flat=True))
+        self.message_user(request, f"Queued {queued} reminder(s). Track them under Reminder jobs.")
+        return None
+
+
+@admin.register(ReminderJob)
+class ReminderJobAdmin(admin.ModelAdmin):
+    list_display = ('settlement', 'status', 'attempts', 'run_after', 'created_at', 'finished_at')
+    list_select_related = ('settlement__payer', 'settlement__receiver')
+    list_filter = ('status',)
+    date_hierarchy = 'created_at'
+    readonly_fields = ('settlement', 'status', 'attempts', 'error', 'run_after', 'started_at', 'created_at',
+                       'finished_at')
+    actions = ['retry']
+
+    def has_add_permission(self, request):
+        return False
+
+    def retry(self, request, queryset):
+        # Give failed reminders a fresh set of attempts
+        retried = queryset.filter(status='failed').update(status='pending', attempts=0, run_after=timezone.now())
+        self.message_user(request, f"Requeued {retried} reminder(s).")
         return None
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'status_code', 'duration_ms', 'sql_count', 'sql_time_ms')
+    list_filter = ('method', 'status_code')
+    date_hierarchy = 'created_at'
+    search_fields = ('path', 'query_string')
+    exclude = ('report',)
+    readonly_fields = ('method', 'path', 'query_string', 'status_code', 'duration_ms', 'sql_count', 'sql_time_ms',
+                       'stats_file', 'created_at', 'slow_queries', 'serializer_time', 'top_functions')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def slow_queries(self, obj):
+        return format_html('<pre>{}</pre>', json.dumps(obj.report.get('slow_queries', []), indent=2))
+
+    def serializer_time(self, obj):
+        return format_html('<pre>{}</pre>', json.dumps(obj.report.get('serializers', []), indent=2))
+
+    def top_functions(self, obj):
+        return format_html('<pre>{}</pre>', stats_text(obj.stats_file))
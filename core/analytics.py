@@ -0,0 +1,198 @@
+from itertools import chain
+
+import numpy as np
+from django.db.models import BigIntegerField, F
+from django.db.models.functions import Cast, ExtractMonth, ExtractYear, Round
+
+from .models import Category
+
+
+def month_index(year, month):
+    """
+    Convert a (year, month) pair into a running month number.
+    """
+    return year * 12 + month - 1
+
+
+def parse_month(value):
+    """
+    Parse a "YYYY-MM" string into a running month number. Empty values give None.
+    """
+    if not value:
+        return None
+    year, month = value.split('-')
+    year, month = int(year), int(month)
+    if not 1 <= month <= 12:
+        raise ValueError(value)
+    return month_index(year, month)
+
+
+def month_label(index):
+    """
+    Convert a running month number back into a "YYYY-MM" label.
+    """
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def fetch_expense_columns(*querysets):
+    """
+    Pull the columns needed for trend analysis with a single query per queryset
+    (live or archived expenses) and return them as NumPy arrays. Amounts are
+    returned in paise so all arithmetic stays integral.
+    """
+    rows = chain.from_iterable(
+        queryset.values_list(
+            'id',
+            'group_id',
+            'category_id',
+            'payer_id',
+            ExtractYear('date'),
+            ExtractMonth('date'),
+            Cast(Round(F('amount') * 100), output_field=BigIntegerField()),
+        ).order_by()
+        for queryset in querysets
+    )
+
+    columns = list(zip(*rows))
+    if not columns:
+        columns = [()] * 7
+    ids, groups, categories, payers, years, months, cents = (
+        np.fromiter(column, dtype=np.int64, count=len(column)) for column in columns
+    )
+    return {
+        'id': ids,
+        'group': groups,
+        'category': categories,
+        'payer': payers,
+        'month': month_index(years, months),
+        'cents': cents,
+    }
+
+
+def monthly_totals(keys, months, cents, n_months):
+    """
+    Sum amounts per (key, month) cell. Returns the distinct keys, the index of
+    each row's key and a len(keys) x n_months matrix of totals in paise.
+    """
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    cells = inverse * n_months + months
+    totals = np.bincount(cells, weights=cents, minlength=len(unique_keys) * n_months)
+    return unique_keys, inverse, totals.reshape(len(unique_keys), n_months)
+
+
+def rolling_average(totals, window):
+    """
+    Trailing moving average along the month axis. The first few months average
+    over however many months are available.
+    """
+    n_months = totals.shape[1]
+    padded = np.zeros((totals.shape[0], n_months + 1))
+    np.cumsum(totals, axis=1, out=padded[:, 1:])
+    upper = np.arange(1, n_months + 1)
+    lower = np.maximum(upper - window, 0)
+    return (padded[:, upper] - padded[:, lower]) / (upper - lower)
+
+
+def group_percentiles(inverse, cents, n_groups, percentiles):
+    """
+    Linear-interpolated percentiles of individual expense amounts per group,
+    computed from one lexsort instead of a per-group loop.
+    """
+    order = np.lexsort((cents, inverse))
+    sorted_cents = cents[order]
+    counts = np.bincount(inverse, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    result = {}
+    for q in percentiles:
+        position = starts + (counts - 1) * (q / 100)
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        fraction = position - low
+        result[q] = sorted_cents[low] + (sorted_cents[high] - sorted_cents[low]) * fraction
+    return result
+
+
+def group_robust_scores(inverse, cents, n_groups):
+    """
+    Modified z-score (Iglewicz and Hoaglin) of every expense relative to its group:
+    0.6745 * (x - median) / MAD. Unlike the mean and standard deviation, the median
+    and MAD are not dragged along by the outliers being scored, and the score is not
+    capped by the group size. Groups where most amounts are equal (MAD = 0) fall back
+    to the mean absolute deviation. Returns the scores and the number of expenses in
+    each expense's group.
+    """
+    counts = np.bincount(inverse, minlength=n_groups)
+    median = group_percentiles(inverse, cents, n_groups, (50,))[50]
+    deviation = cents - median[inverse]
+    absolute = np.abs(deviation)
+    mad = group_percentiles(inverse, absolute, n_groups, (50,))[50]
+    mean_absolute = np.bincount(inverse, weights=absolute, minlength=n_groups) / counts
+
+    spread = np.where(mad > 0, mad / 0.6745, mean_absolute * 1.253314)[inverse]
+    scores = np.divide(deviation, spread, out=np.zeros_like(deviation, dtype=np.float64), where=spread > 0)
+    return scores, counts[inverse]
+
+
+def _series(keys, totals, window):
+    averages = rolling_average(totals, window)
+    return [
+        {
+            'id': key,
+            'totals': (row / 100).round(2).tolist(),
+            'rolling_average': (avg / 100).round(2).tolist(),
+        }
+        for key, row, avg in zip(keys.tolist(), totals, averages)
+    ]
+
+
+def spending_trends(expenses, start_month, end_month, window=3, percentiles=(50, 90, 99),
+                    z_threshold=3.5, min_samples=5, max_anomalies=100, archived=None):
+    """
+    Compute month-by-month spending series per group, category and payer, rolling
+    averages, per-group percentiles and anomalous expenses for the given month range.
+    `start_month` and `end_month` are running month numbers (see `month_index`).
+    Rows of the optional `archived` ArchivedExpense queryset count like live expenses.
+    """
+    n_months = end_month - start_month + 1
+    columns = fetch_expense_columns(expenses, *([archived] if archived is not None else []))
+    months = columns['month'] - start_month
+    cents = columns['cents']
+
+    group_keys, group_inverse, group_totals = monthly_totals(columns['group'], months, cents, n_months)
+    category_keys, _, category_totals = monthly_totals(columns['category'], months, cents, n_months)
+    payer_keys, _, payer_totals = monthly_totals(columns['payer'], months, cents, n_months)
+
+    groups = _series(group_keys, group_totals, window)
+    categories = _series(category_keys, category_totals, window)
+    category_names = Category.objects.in_bulk(category_keys.tolist())
+    for entry in categories:
+        category = category_names.get(entry['id'])
+        entry['name'] = category.name if category else None
+
+    anomalies = []
+    if len(cents):
+        stats = group_percentiles(group_inverse, cents, len(group_keys), percentiles)
+        for i, entry in enumerate(groups):
+            entry['percentiles'] = {f"p{q}": round(float(values[i]) / 100, 2) for q, values in stats.items()}
+
+        scores, sizes = group_robust_scores(group_inverse, cents, len(group_keys))
+        flagged = np.flatnonzero((np.abs(scores) >= z_threshold) & (sizes >= min_samples))
+        flagged = flagged[np.argsort(-np.abs(scores[flagged]), kind='stable')][:max_anomalies]
+        anomalies = [
+            {
+                'expense_id': int(columns['id'][i]),
+                'group_id': int(columns['group'][i]),
+                'amount': round(float(cents[i]) / 100, 2),
+                'z_score': round(float(scores[i]), 2),
+            }
+            for i in flagged
+        ]
+
+    return {
+        'months': [month_label(start_month + i) for i in range(n_months)],
+        'groups': groups,
+        'categories': categories,
+        'students': _series(payer_keys, payer_totals, window),
+        'anomalies': anomalies,
+    }
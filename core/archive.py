@@ -0,0 +1,192 @@
+from datetime import date
+
+from django.db import connection, transaction
+from django.utils.functional import cached_property
+
+from .models import ArchivedExpense, ArchivedSettlement, Expense, Settlement
+from .signals import tombstones_disabled
+
+EXPENSE_FIELDS = ['id', 'amount', 'category_id', 'split_type', 'date', 'receipt_image', 'group_id', 'payer_id',
+                  'members_split']
+SETTLEMENT_FIELDS = ['id', 'expense_id', 'group_id', 'payer_id', 'receiver_id', 'amount', 'payment_status',
+                     'settlement_method', 'due_date']
+PARTITIONED_MODELS = (ArchivedExpense, ArchivedSettlement)
+
+
+class PartitioningUnsupported(Exception):
+    """
+    The database cannot partition the archive tables.
+    """
+
+
+class ArchiveChain:
+    """
+    A live queryset followed by its archived counterpart, sliceable and countable so
+    it can be handed to a paginator.
+    """
+    ordered = True
+
+    def __init__(self, *querysets):
+        self.querysets = querysets
+
+    @cached_property
+    def sizes(self):
+        return [queryset.count() for queryset in self.querysets]
+
+    def count(self):
+        return sum(self.sizes)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        for queryset in self.querysets:
+            yield from queryset
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        items = []
+        for queryset, size in zip(self.querysets, self.sizes):
+            if stop is not None and stop <= 0:
+                break
+            if start < size:
+                items.extend(queryset[start:stop])
+            start = max(start - size, 0)
+            stop = None if stop is None else stop - size
+        return items
+
+
+def archivable_expenses(cutoff):
+    """
+    Expenses dated before `cutoff` with no pending settlements.
+    """
+    return Expense.objects.filter(date__lt=cutoff).exclude(settlements__payment_status=False)
+
+
+def archivable_settlements(cutoff):
+    """
+    Settled settlements without an expense, due before `cutoff`. Settlements that belong
+    to an expense are archived together with it.
+    """
+    return Settlement.objects.filter(expense__isnull=True, payment_status=True, due_date__lt=cutoff)
+
+
+def archive_expenses(cutoff, chunk_size=1000):
+    """
+    Move archivable expenses and their settlements into the archive tables, one
+    transaction per chunk. Yields the number of expenses moved by each chunk.
+    """
+    partitioned = is_partitioned(ArchivedExpense)
+    while True:
+        with transaction.atomic():
+            ids = list(
+                archivable_expenses(cutoff).select_for_update().order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not ids:
+                return
+            expenses = list(Expense.objects.filter(pk__in=ids).values(*EXPENSE_FIELDS))
+            settlements = list(Settlement.objects.filter(expense_id__in=ids).values(*SETTLEMENT_FIELDS))
+            dates = {expense['id']: expense['date'] for expense in expenses}
+            if partitioned:
+                ensure_month_partitions(ArchivedExpense, dates.values())
+                ensure_month_partitions(ArchivedSettlement, dates.values())
+
+            ArchivedExpense.objects.bulk_create([ArchivedExpense(**expense) for expense in expenses])
+            ArchivedSettlement.objects.bulk_create([
+                ArchivedSettlement(date=dates[settlement['expense_id']], **settlement) for settlement in settlements
+            ])
+            with tombstones_disabled():  # Archived rows are moved, not deleted, for sync clients
+                Settlement.objects.filter(expense_id__in=ids).delete()
+                Expense.objects.filter(pk__in=ids).delete()
+        yield len(ids)
+
+
+def archive_settlements(cutoff, chunk_size=1000):
+    """
+    Move archivable standalone settlements into the archive table, one transaction
+    per chunk. Yields the number of settlements moved by each chunk.
+    """
+    partitioned = is_partitioned(ArchivedSettlement)
+    while True:
+        with transaction.atomic():
+            ids = list(
+                archivable_settlements(cutoff).select_for_update().order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not ids:
+                return
+            settlements = list(Settlement.objects.filter(pk__in=ids).values(*SETTLEMENT_FIELDS))
+            if partitioned:
+                ensure_month_partitions(ArchivedSettlement, [settlement['due_date'] for settlement in settlements])
+
+            ArchivedSettlement.objects.bulk_create([
+                ArchivedSettlement(date=settlement['due_date'], **settlement) for settlement in settlements
+            ])
+            with tombstones_disabled():
+                Settlement.objects.filter(pk__in=ids).delete()
+        yield len(ids)
+
+
+def is_partitioned(model):
+    """
+    Whether the model's table is a PostgreSQL partitioned table.
+    """
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+        row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def _month_bounds(day):
+    start = day.replace(day=1)
+    end = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+
+def ensure_month_partitions(model, dates):
+    """
+    Create the monthly partitions of a partitioned archive table covering `dates`.
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        for start, end in sorted({_month_bounds(day) for day in dates}):
+            partition = connection.ops.quote_name(f"{table}_y{start.year}m{start.month:02d}")
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {connection.ops.quote_name(table)} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+
+
+def partition_archive_tables():
+    """
+    Convert the archive tables into tables range-partitioned by month on `date`
+    (PostgreSQL only). Existing rows are copied over. Does nothing for tables that
+    are already partitioned.
+    """
+    if connection.vendor != 'postgresql':
+        raise PartitioningUnsupported("Date partitioning is only supported on PostgreSQL.")
+
+    quote = connection.ops.quote_name
+    for model in PARTITIONED_MODELS:
+        if is_partitioned(model):
+            continue
+        table = model._meta.db_table
+        old = f"{table}_unpartitioned"
+        indexed = [field.column for field in model._meta.fields if field.db_index and not field.primary_key]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {quote(table)} RENAME TO {quote(old)}")
+            cursor.execute(
+                f"CREATE TABLE {quote(table)} (LIKE {quote(old)} INCLUDING DEFAULTS) PARTITION BY RANGE (date)"
+            )
+            # Unique constraints on a partitioned table must include the partition key
+            cursor.execute(f"ALTER TABLE {quote(table)} ADD PRIMARY KEY (id, date)")
+            for column in indexed:
+                cursor.execute(f"CREATE INDEX ON {quote(table)} ({quote(column)})")
+            cursor.execute(f"CREATE TABLE {quote(table + '_default')} PARTITION OF {quote(table)} DEFAULT")
+            cursor.execute(f"SELECT DISTINCT date FROM {quote(old)}")
+            ensure_month_partitions(model, [row[0] for row in cursor.fetchall()])
+            cursor.execute(f"INSERT INTO {quote(table)} SELECT * FROM {quote(old)}")
+            cursor.execute(f"DROP TABLE {quote(old)}")
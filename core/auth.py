@@ -0,0 +1,43 @@
+from django.db.models import Q
+
+from .models import Group, Student
+
+
+def get_student(user):
+    """
+    Return the Student behind an authenticated user. JWT tokens are issued for the
+    default user model, so those users are matched to students by username.
+    """
+    if isinstance(user, Student):
+        return user
+    if user is None or not user.is_authenticated:
+        return None
+    return Student.objects.filter(username=user.get_username(), deletion_requested_at__isnull=True).first()
+
+
+def member_group_ids(student):
+    """
+    Subquery of the ids of the groups `student` belongs to, skipping groups pending
+    deletion. Served by the (student_id, group_id) index on the membership table.
+    """
+    return Group.members.through.objects.filter(
+        student_id=student.pk if student else None, group__deletion_requested_at__isnull=True
+    ).values('group_id')
+
+
+def without_pending_students(*fields):
+    """
+    Filter for rows whose student foreign keys `fields` don't point at a student
+    pending deletion. Such rows stay hidden until `manage.py purge_deleted` removes
+    them. Empty nullable relations pass.
+    """
+    return Q(*(Q(**{f'{field}__deletion_requested_at__isnull': True}) for field in fields))
+
+
+def visible_students(student):
+    """
+    Filter for the students `student` can see: themselves and everyone sharing a
+    group with them.
+    """
+    members = Group.members.through.objects.filter(group_id__in=member_group_ids(student)).values('student_id')
+    return Q(pk=student.pk if student else None) | Q(pk__in=members)
@@ -0,0 +1,107 @@
+"""
+Deferred deletion of groups and students.
+
+Deleting a group or student through the API only marks it with
+`deletion_requested_at`, which hides it straight away. `manage.py purge_deleted`
+later removes its expenses, settlements, archived rows and statement jobs in
+small batches, each committed on its own, and finally the object itself, so no
+single delete has to collect a whole history in memory.
+"""
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import (
+    ArchivedExpense, ArchivedSettlement, Expense, Group, Settlement, StatementJob, Student, Tombstone,
+)
+from .signals import tombstones_disabled
+
+# Models whose deletions are published to delta sync clients
+TOMBSTONE_MODELS = {Expense: 'expense', Settlement: 'settlement'}
+
+
+def request_deletion(obj):
+    """
+    Mark a group or student as pending deletion. Students are also deactivated.
+    Members of a group get tombstones right away so synced clients drop it too.
+    """
+    obj.deletion_requested_at = timezone.now()
+    fields = ['deletion_requested_at']
+    if isinstance(obj, Student):
+        obj.is_active = False
+        fields.append('is_active')
+    with transaction.atomic():
+        obj.save(update_fields=fields)
+        if isinstance(obj, Group):
+            Tombstone.objects.bulk_create([
+                Tombstone(model='group', object_id=obj.pk, student_id=student_id)
+                for student_id in obj.members.values_list('id', flat=True)
+            ])
+
+
+def dependents(obj):
+    """
+    (label, queryset) pairs of the rows to purge before `obj`, in deletion order.
+    Settlements go before expenses so an expense batch only cascades to a few rows.
+    """
+    if isinstance(obj, Group):
+        return [
+            ('settlements', Settlement.objects.filter(Q(group=obj) | Q(expense__group=obj))),
+            ('expenses', Expense.objects.filter(group=obj)),
+            ('archived settlements', ArchivedSettlement.objects.filter(group=obj)),
+            ('archived expenses', ArchivedExpense.objects.filter(group=obj)),
+            ('statement jobs', StatementJob.objects.filter(subject_type='group', subject_id=obj.pk)),
+        ]
+    return [
+        ('settlements', Settlement.objects.filter(
+            Q(payer=obj) | Q(receiver=obj) | Q(expense__payer=obj)
+        )),
+        ('expenses', Expense.objects.filter(payer=obj)),
+        ('archived settlements', ArchivedSettlement.objects.filter(Q(payer=obj) | Q(receiver=obj))),
+        ('archived expenses', ArchivedExpense.objects.filter(payer=obj)),
+        ('statement jobs', StatementJob.objects.filter(
+            Q(subject_type='student', subject_id=obj.pk) | Q(requested_by=obj)
+        )),
+    ]
+
+
+def purge(obj, batch_size=500):
+    """
+    Delete a pending group or student and everything that depends on it, one
+    transaction per batch. Yields (label, rows deleted) after each batch.
+
+    A group's members already got its tombstone when deletion was requested. For a
+    student, the expenses and settlements removed from groups that live on are
+    tombstoned in bulk per batch.
+    """
+    for label, queryset in dependents(obj):
+        model = queryset.model
+        tombstones = isinstance(obj, Student) and model in TOMBSTONE_MODELS
+        while True:
+            with transaction.atomic():
+                fields = ('pk', 'group_id') if tombstones else ('pk',)
+                rows = list(queryset.order_by('pk').values_list(*fields)[:batch_size])
+                if not rows:
+                    break
+                with tombstones_disabled():
+                    model.objects.filter(pk__in=[row[0] for row in rows]).delete()
+                if tombstones:
+                    Tombstone.objects.bulk_create([
+                        Tombstone(model=TOMBSTONE_MODELS[model], object_id=pk, group_id=group_id)
+                        for pk, group_id in rows
+                    ])
+            yield label, len(rows)
+
+    with transaction.atomic(), tombstones_disabled():
+        if isinstance(obj, Student):
+            obj.groups_set.clear()
+        obj.delete()
+    yield 'object', 1
+
+
+def pending_deletions():
+    """
+    Groups, then students, waiting to be purged, oldest request first.
+    """
+    yield from Group.objects.filter(deletion_requested_at__isnull=False).order_by('deletion_requested_at')
+    yield from Student.objects.filter(deletion_requested_at__isnull=False).order_by('deletion_requested_at')
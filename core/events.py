@@ -0,0 +1,111 @@
+import asyncio
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+class Subscription:
+    """
+    A subscriber's bounded event queue, bound to the event loop that created it.
+    """
+
+    def __init__(self, channel, maxsize):
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def deliver(self, event):
+        # Runs on the subscriber's loop. Slow consumers lose their oldest events.
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class InProcessBackend:
+    """
+    Pub/sub within a single worker process. Publishing is thread-safe, so events
+    committed by sync views reach subscribers running on the ASGI event loop.
+
+    Other backends (e.g. one relaying through Redis to reach every worker) need the
+    same subscribe/unsubscribe/publish methods and are selected with EVENTS_BACKEND.
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel, self.queue_size)
+        with self._lock:
+            self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The subscriber's loop has shut down
+                self.unsubscribe(subscription)
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    """
+    Return the process-wide event backend configured by EVENTS_BACKEND.
+    """
+    backend = getattr(settings, 'EVENTS_BACKEND', 'core.events.InProcessBackend')
+    return import_string(backend)(**getattr(settings, 'EVENTS_BACKEND_OPTIONS', {}))
+
+
+def group_channel(group_id):
+    return f"group:{group_id}"
+
+
+def publish_group_event(group_id, event_type, data):
+    """
+    Publish an event to a group's subscribers once the current transaction commits.
+    """
+    if group_id is None:
+        return
+    event = {'type': event_type, 'data': data}
+    transaction.on_commit(lambda: get_broker().publish(group_channel(group_id), event))
+
+
+def expense_event(expense):
+    return {
+        'id': expense.pk,
+        'amount': str(expense.amount),
+        'payer_id': expense.payer_id,
+        'category_id': expense.category_id,
+        'split_type': expense.split_type,
+    }
+
+
+def settlement_event(settlement):
+    return {
+        'id': settlement.pk,
+        'expense_id': settlement.expense_id,
+        'payer_id': settlement.payer_id,
+        'receiver_id': settlement.receiver_id,
+        'amount': str(settlement.amount),
+        'payment_status': settlement.payment_status,
+    }
@@ -0,0 +1,46 @@
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.archive import archive_expenses, archive_settlements, partition_archive_tables, PartitioningUnsupported
+
+
+class Command(BaseCommand):
+    help = "Move settled settlements and closed expenses older than a cutoff into the archive tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--before', type=date.fromisoformat,
+            help="Archive rows dated before this day (YYYY-MM-DD). "
+                 "Defaults to ARCHIVE_AFTER_DAYS days ago.",
+        )
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Rows moved per transaction.")
+        parser.add_argument(
+            '--partition', action='store_true',
+            help="Convert the archive tables to monthly date partitions first (PostgreSQL only).",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = options['before'] or date.today() - timedelta(days=getattr(settings, 'ARCHIVE_AFTER_DAYS', 365))
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be positive.")
+
+        if options['partition']:
+            try:
+                partition_archive_tables()
+            except PartitioningUnsupported as e:
+                raise CommandError(str(e))
+            self.stdout.write("Archive tables are partitioned by month.")
+
+        total = 0
+        for moved in archive_expenses(cutoff, options['chunk_size']):
+            total += moved
+            self.stdout.write(f"Archived {total} expenses...")
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} expenses dated before {cutoff}."))
+
+        total = 0
+        for moved in archive_settlements(cutoff, options['chunk_size']):
+            total += moved
+            self.stdout.write(f"Archived {total} settlements...")
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} standalone settlements due before {cutoff}."))
@@ -0,0 +1,78 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Each run starts a fresh interpreter, imports the server entry point and serves one
+# request, reporting timings relative to the moment the parent spawned it.
+WSGI_SCRIPT = """
+import json, os, sys, time
+from wsgiref.util import setup_testing_defaults
+spawned = float(os.environ['BENCH_SPAWNED_AT'])
+from pocketsense.wsgi import application
+imported = time.time()
+environ = {'PATH_INFO': sys.argv[1]}
+setup_testing_defaults(environ)
+statuses = []
+b''.join(application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+done = time.time()
+print(json.dumps({'import': imported - spawned, 'first_request': done - spawned, 'status': statuses[0]}))
+"""
+
+ASGI_SCRIPT = """
+import asyncio, json, os, sys, time
+spawned = float(os.environ['BENCH_SPAWNED_AT'])
+from pocketsense.asgi import application
+imported = time.time()
+scope = {
+    'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+    'path': sys.argv[1], 'raw_path': sys.argv[1].encode(), 'query_string': b'', 'root_path': '',
+    'headers': [(b'host', b'127.0.0.1')], 'client': ('127.0.0.1', 0), 'server': ('127.0.0.1', 80),
+}
+statuses = []
+messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+async def receive():
+    if messages:
+        return messages.pop()
+    await asyncio.Event().wait()  # The client never disconnects
+async def send(message):
+    if message['type'] == 'http.response.start':
+        statuses.append(message['status'])
+asyncio.run(application(scope, receive, send))
+done = time.time()
+print(json.dumps({'import': imported - spawned, 'first_request': done - spawned, 'status': statuses[0]}))
+"""
+
+
+class Command(BaseCommand):
+    help = "Measure cold-start time to first request for the WSGI and ASGI applications."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help="Fresh processes per server.")
+        parser.add_argument('--path', default='/api/categories/', help="Path of the first request.")
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE))
+        for name, script in (('wsgi', WSGI_SCRIPT), ('asgi', ASGI_SCRIPT)):
+            results = [self._run(script, options['path'], env) for _ in range(options['runs'])]
+            imports = [result['import'] * 1000 for result in results]
+            firsts = [result['first_request'] * 1000 for result in results]
+            self.stdout.write(
+                f"{name}: status {results[0]['status']}, "
+                f"import {statistics.median(imports):.1f} ms (min {min(imports):.1f}), "
+                f"time to first request {statistics.median(firsts):.1f} ms (min {min(firsts):.1f})"
+            )
+
+    def _run(self, script, path, env):
+        env = dict(env, BENCH_SPAWNED_AT=repr(time.time()))
+        process = subprocess.run(
+            [sys.executable, '-c', script, path], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+        )
+        if process.returncode:
+            raise CommandError(process.stderr)
+        return json.loads(process.stdout.strip().splitlines()[-1])
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from pocketsense.schema import schema_path, write_schema
+
+
+class Command(BaseCommand):
+    help = "Generate the OpenAPI schema artifact served at /docs/openapi.json."
+
+    def handle(self, *args, **options):
+        version = write_schema()
+        self.stdout.write(self.style.SUCCESS(f"Wrote schema {version} to {schema_path()}."))
@@ -0,0 +1,29 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.reminders import claim_reminders, process_reminders
+
+
+class Command(BaseCommand):
+    help = "Send queued payment reminder emails, retrying failed ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.REMINDER_BATCH_SIZE,
+                            help="Reminders claimed and sent over one mail connection.")
+        parser.add_argument('--loop', action='store_true', help="Keep polling for new reminders.")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds between polls with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            jobs = claim_reminders(options['batch_size'])
+            if jobs:
+                process_reminders(jobs)
+                sent = sum(job.status == 'sent' for job in jobs)
+                retrying = sum(job.status == 'pending' for job in jobs)
+                self.stdout.write(f"Processed {len(jobs)} reminders ({sent} sent, {retrying} to retry).")
+            elif not options['loop']:
+                break
+            else:
+                time.sleep(options['interval'])
@@ -0,0 +1,30 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.statements import claim_jobs, process_jobs
+
+
+class Command(BaseCommand):
+    help = "Render pending monthly statement jobs on a process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.STATEMENT_BATCH_SIZE,
+                            help="Jobs claimed and fetched together.")
+        parser.add_argument('--workers', type=int, default=settings.STATEMENT_WORKERS,
+                            help="Render processes. Defaults to the number of CPUs.")
+        parser.add_argument('--loop', action='store_true', help="Keep polling for new jobs.")
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds between polls with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            jobs = claim_jobs(options['batch_size'])
+            if jobs:
+                process_jobs(jobs, options['workers'])
+                done = sum(job.status == 'done' for job in jobs)
+                self.stdout.write(f"Processed {len(jobs)} statement jobs ({done} done, {len(jobs) - done} failed).")
+            elif not options['loop']:
+                break
+            else:
+                time.sleep(options['interval'])
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.sync import prune_sync_records
+
+
+class Command(BaseCommand):
+    help = "Delete delta sync tombstones and join records older than SYNC_RETENTION_DAYS."
+
+    def handle(self, *args, **options):
+        deleted = prune_sync_records()
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} sync records older than {settings.SYNC_RETENTION_DAYS} days."
+        ))
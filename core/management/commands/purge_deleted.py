@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.deletion import pending_deletions, purge
+
+
+class Command(BaseCommand):
+    help = "Delete groups and students pending deletion, and their data, in small committed batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.DELETION_BATCH_SIZE,
+                            help="Rows deleted per transaction.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        purged = 0
+        for obj in pending_deletions():
+            name = f"{obj._meta.model_name} {obj.pk}"
+            totals = {}
+            for label, deleted in purge(obj, options['batch_size']):
+                if label == 'object':
+                    continue
+                totals[label] = totals.get(label, 0) + deleted
+                self.stdout.write(f"{name}: deleted {totals[label]} {label}...")
+            purged += 1
+            self.stdout.write(f"Purged {name}.")
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} pending deletions."))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_alter_settlement_due_date'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='expense',
+            name='date',
+            field=models.DateField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='settlement',
+            name='due_date',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+    ]
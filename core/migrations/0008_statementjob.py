@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_sync_timestamps_tombstone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatementJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject_type', models.CharField(choices=[('student', 'Student'), ('group', 'Group')], max_length=20)),
+                ('subject_id', models.BigIntegerField()),
+                ('month', models.DateField()),
+                ('file_format', models.CharField(choices=[('pdf', 'PDF'), ('csv', 'CSV')], max_length=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('data_version', models.CharField(blank=True, max_length=64)),
+                ('file_path', models.CharField(blank=True, max_length=500)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('requested_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statement_jobs', to='core.student')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='core_statem_status_c2baa5_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_requestprofile'),
+    ]
+
+    operations = [
+        # Membership lookups start from the student; (group_id, student_id) from the
+        # unique constraint cannot serve them, so add the reverse composite index
+        migrations.RunSQL(
+            'CREATE INDEX core_group_members_student_group_idx ON core_group_members (student_id, group_id)',
+            reverse_sql='DROP INDEX core_group_members_student_group_idx',
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['group', 'date'], name='core_expense_group_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='settlement',
+            index=models.Index(fields=['group', 'payment_status'], name='core_settle_group_status_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_membership_scope_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupJoin',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group_id', models.BigIntegerField()),
+                ('student_id', models.BigIntegerField()),
+                ('joined_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['student_id', 'joined_at'], name='core_groupj_student_3e7c94_idx')],
+            },
+        ),
+    ]
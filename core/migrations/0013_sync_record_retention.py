@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_groupjoin'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='groupjoin',
+            name='joined_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='tombstone',
+            name='deleted_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_reminderjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='statementjob',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='statementjob',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,6 +1,7 @@
 import json
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
 
 from django.contrib.auth.models import AbstractUser, Group as AuthGroup, Permission
 
@@ -14,6 +15,7 @@ class Student(AbstractUser):
     college = models.CharField(max_length=255)
     semester = models.IntegerField()
     default_payment_methods = models.JSONField(default=dict, validators=[validate_json])
+    deletion_requested_at = models.DateTimeField(null=True, blank=True, db_index=True)  # Purged by `manage.py purge_deleted`
 
     # Avoid clashes with reverse accessors by specifying unique related_name
     groups = models.ManyToManyField(
@@ -43,6 +45,8 @@ class Group(models.Model):
         Student,
         related_name="groups_set", # Renamed to avoid conflict
     )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    deletion_requested_at = models.DateTimeField(null=True, blank=True, db_index=True)  # Purged by `manage.py purge_deleted`
 
     def __str__(self):
         return self.name
@@ -57,11 +61,18 @@ class Expense(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="expenses")
     split_type = models.CharField(max_length=50, choices=[('equal', 'Equal'), ('proportional', 'Proportional')]) # E.g., "equal", "proportional"
-    date = models.DateField(auto_now_add=True)
+    date = models.DateField(auto_now_add=True, db_index=True)
     receipt_image = models.ImageField(upload_to="receipts/", blank=True, null=True)
     group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name="expenses")
     payer = models.ForeignKey(Student, on_delete=models.CASCADE, related_name="paid_expenses")
     members_split = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['group', 'updated_at']),  # Delta sync per group
+            models.Index(fields=['group', 'date'], name='core_expense_group_date_idx'),  # Member-scoped lists
+        ]
 
     def __str__(self):
         return f"{self.group.name} - {self.amount} - {self.date}"
@@ -81,7 +92,14 @@ class Settlement(models.Model):
         ('card', 'Card'),
     ]
     settlement_method = models.CharField(max_length=50, choices=SETTLEMENT_METHOD_CHOICES) # E.g., "Cash", "UPI", etc.
-    due_date = models.DateField(null=True, blank=True)
+    due_date = models.DateField(null=True, blank=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['group', 'updated_at']),  # Delta sync per group
+            models.Index(fields=['group', 'payment_status'], name='core_settle_group_status_idx'),  # Member-scoped lists
+        ]
 
     def __str__(self):
         return f"{self.payer.username} owes {self.receiver.username} - {self.amount}"
@@ -94,3 +112,177 @@ class Settlement(models.Model):
         return "Pending" if not self.payment_status else "Settled"
 
     payment_status_display.short_description = 'Payment Status'
+
+class Tombstone(models.Model):
+    """
+    Records a deleted row so delta sync clients can drop it. Tombstones are addressed
+    to a group's members (`group_id`) or to a single student (`student_id`), e.g. when a
+    group is deleted or a student leaves it.
+    """
+    MODEL_CHOICES = [
+        ('group', 'Group'),
+        ('expense', 'Expense'),
+        ('settlement', 'Settlement'),
+    ]
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.BigIntegerField()
+    group_id = models.BigIntegerField(null=True, blank=True)
+    student_id = models.BigIntegerField(null=True, blank=True)
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['group_id', 'deleted_at']),
+            models.Index(fields=['student_id', 'deleted_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.model} {self.object_id} deleted at {self.deleted_at}"
+
+class GroupJoin(models.Model):
+    """
+    Records a student joining a group, so delta sync can send them the group's
+    history from before their sync cursor.
+    """
+    group_id = models.BigIntegerField()
+    student_id = models.BigIntegerField()
+    joined_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['student_id', 'joined_at']),
+        ]
+
+    def __str__(self):
+        return f"student {self.student_id} joined group {self.group_id} at {self.joined_at}"
+
+class StatementJob(models.Model):
+    """
+    A request for a monthly statement file, rendered in the background by
+    `manage.py process_statements`. A job left running by a worker that died is
+    claimed again once its lease of STATEMENT_LEASE_SECONDS runs out.
+    """
+    SUBJECT_CHOICES = [
+        ('student', 'Student'),
+        ('group', 'Group'),
+    ]
+    FORMAT_CHOICES = [
+        ('pdf', 'PDF'),
+        ('csv', 'CSV'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    subject_type = models.CharField(max_length=20, choices=SUBJECT_CHOICES)
+    subject_id = models.BigIntegerField()
+    month = models.DateField()  # First day of the statement month
+    file_format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    data_version = models.CharField(max_length=64, blank=True)
+    file_path = models.CharField(max_length=500, blank=True)
+    error = models.TextField(blank=True)
+    requested_by = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='statement_jobs')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.subject_type} {self.subject_id} {self.month:%Y-%m} ({self.file_format}, {self.status})"
+
+class ReminderJob(models.Model):
+    """
+    A queued payment reminder email for a settlement, sent by
+    `manage.py process_reminders`. Failed sends are retried with a growing delay
+    until REMINDER_MAX_ATTEMPTS is reached.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),  # Settled before the reminder went out
+    ]
+    settlement = models.ForeignKey(Settlement, on_delete=models.CASCADE, related_name='reminder_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+    def __str__(self):
+        return f"reminder for settlement {self.settlement_id} ({self.status})"
+
+class RequestProfile(models.Model):
+    """
+    Index entry for a profiled request. The pstats dump lives in PROFILING_DIR and
+    only the newest PROFILING_MAX_ENTRIES profiles are kept.
+    """
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    query_string = models.TextField(blank=True)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    sql_count = models.PositiveIntegerField()
+    sql_time_ms = models.FloatField()
+    report = models.JSONField(default=dict)  # Slowest queries with EXPLAIN output and serializer timings
+    stats_file = models.CharField(max_length=500)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+class ArchivedExpense(models.Model):
+    """
+    An expense moved out of the live table by `manage.py archive`. Keeps the original id.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    split_type = models.CharField(max_length=50, choices=[('equal', 'Equal'), ('proportional', 'Proportional')])
+    date = models.DateField(db_index=True)
+    receipt_image = models.ImageField(upload_to="receipts/", blank=True, null=True)
+    group = models.ForeignKey(Group, on_delete=models.DO_NOTHING, db_constraint=False, related_name='archived_expenses')
+    payer = models.ForeignKey(Student, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    members_split = models.JSONField(default=dict)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.group_id} - {self.amount} - {self.date} (archived)"
+
+class ArchivedSettlement(models.Model):
+    """
+    A settled settlement moved out of the live table by `manage.py archive`. `date` is the
+    date of its expense, or its due date for standalone settlements.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    expense = models.ForeignKey(ArchivedExpense, on_delete=models.DO_NOTHING, db_constraint=False,
+                                related_name='settlements', null=True, blank=True)
+    group = models.ForeignKey(Group, on_delete=models.DO_NOTHING, db_constraint=False,
+                              related_name='archived_settlements', null=True, blank=True)
+    payer = models.ForeignKey(Student, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    receiver = models.ForeignKey(Student, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    payment_status = models.BooleanField(default=True)
+    settlement_method = models.CharField(max_length=50, choices=Settlement.SETTLEMENT_METHOD_CHOICES)
+    due_date = models.DateField(null=True, blank=True)
+    date = models.DateField(db_index=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.payer_id} paid {self.receiver_id} - {self.amount} (archived)"
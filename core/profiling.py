@@ -0,0 +1,239 @@
+"""
+Opt-in request profiling.
+
+A request is profiled when it carries a valid signed X-Profile header (see
+`manage.py profile_token`) or is picked by PROFILING_SAMPLE_RATE. The profile
+holds a cProfile dump, every SQL statement with its timing, EXPLAIN output for
+the slowest SELECTs and the time spent in serializer code. Dumps are written to
+PROFILING_DIR and indexed by RequestProfile rows, which are browsable in the admin.
+SQL parameters and query string values are redacted before they are stored, since
+they can hold credentials (token endpoints, the event stream's ?token= JWT).
+"""
+import cProfile
+import logging
+import pstats
+import random
+import time
+import uuid
+from io import StringIO
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.db import connection
+
+from .models import RequestProfile
+
+logger = logging.getLogger(__name__)
+
+TOKEN_SALT = 'core.profiling'
+TOKEN_VALUE = 'profile'
+REDACTED = '[redacted]'
+
+# Modules whose functions count as serializer time
+SERIALIZER_MODULES = ('serializers.py', 'rest_framework/fields.py', 'rest_framework/relations.py')
+
+
+def make_token():
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(TOKEN_VALUE)
+
+
+def redact_params(params):
+    """
+    Replace SQL parameter values with their type names, keeping the shape of
+    executemany parameter lists.
+    """
+    if isinstance(params, dict):
+        return {key: redact_params(value) for key, value in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [redact_params(value) for value in params]
+    return None if params is None else f"<{type(params).__name__}>"
+
+
+def redact_query_string(query_string):
+    """
+    Keep the parameter names of a query string and blank out their values.
+    """
+    pairs = parse_qsl(query_string, keep_blank_values=True)
+    return urlencode([(key, REDACTED if value else '') for key, value in pairs], safe='[]')
+
+
+def should_profile(request):
+    token = request.headers.get('X-Profile')
+    if token:
+        try:
+            value = signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+            return value == TOKEN_VALUE
+        except signing.BadSignature:
+            return False
+    return random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper recording each statement and its duration.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'params': params,
+                'many': many,
+                'time_ms': (time.perf_counter() - start) * 1000,
+            })
+
+
+def explain(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+        return "\n".join(" ".join(str(column) for column in row) for row in cursor.fetchall())
+
+
+def slow_queries(queries):
+    """
+    The slowest statements, with EXPLAIN output for the slowest SELECTs.
+    """
+    slowest = sorted(queries, key=lambda query: query['time_ms'], reverse=True)[:settings.PROFILING_SLOW_QUERIES]
+    explained = 0
+    report = []
+    for query in slowest:
+        entry = {'sql': query['sql'], 'params': redact_params(query['params']), 'time_ms': round(query['time_ms'], 3)}
+        if (explained < settings.PROFILING_EXPLAIN_QUERIES and not query['many']
+                and query['sql'].lstrip().upper().startswith('SELECT')):
+            try:
+                entry['explain'] = explain(query['sql'], query['params'])
+            except Exception as e:
+                entry['explain'] = f"EXPLAIN failed: {e}"
+            explained += 1
+        report.append(entry)
+    return report
+
+
+def serializer_breakdown(stats, limit=15):
+    """
+    Functions in serializer modules by cumulative time. Nested calls are counted
+    in their callers too, so the rows overlap.
+    """
+    rows = []
+    for (filename, lineno, function), (_, calls, own, cumulative, _) in stats.stats.items():
+        if Path(filename).as_posix().endswith(SERIALIZER_MODULES):
+            rows.append({
+                'function': f"{Path(filename).parent.name}/{Path(filename).name}:{lineno}({function})",
+                'calls': calls,
+                'own_ms': round(own * 1000, 3),
+                'cumulative_ms': round(cumulative * 1000, 3),
+            })
+    rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+    return rows[:limit]
+
+
+def stats_text(path, limit=40):
+    """
+    The top of a stored pstats dump, sorted by cumulative time.
+    """
+    stream = StringIO()
+    try:
+        pstats.Stats(str(path), stream=stream).sort_stats('cumulative').print_stats(limit)
+    except OSError:
+        return "Profile file is no longer available."
+    return stream.getvalue()
+
+
+def save_profile(request, response, profiler, recorder, duration):
+    directory = Path(settings.PROFILING_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{uuid.uuid4().hex}.prof"
+    stats = pstats.Stats(profiler)
+    stats.dump_stats(str(path))
+
+    profile = RequestProfile.objects.create(
+        method=request.method,
+        path=request.path[:500],
+        query_string=redact_query_string(request.META.get('QUERY_STRING', '')),
+        status_code=response.status_code,
+        duration_ms=duration * 1000,
+        sql_count=len(recorder.queries),
+        sql_time_ms=sum(query['time_ms'] for query in recorder.queries),
+        report={
+            'slow_queries': slow_queries(recorder.queries),
+            'serializers': serializer_breakdown(stats),
+        },
+        stats_file=str(path),
+    )
+    prune_profiles()
+    return profile
+
+
+def prune_profiles():
+    """
+    Keep only the newest PROFILING_MAX_ENTRIES profiles and their dumps.
+    """
+    stale = list(
+        RequestProfile.objects.order_by('-created_at', '-pk')
+        .values_list('pk', 'stats_file')[settings.PROFILING_MAX_ENTRIES:]
+    )
+    for _, stats_file in stale:
+        Path(stats_file).unlink(missing_ok=True)
+    RequestProfile.objects.filter(pk__in=[pk for pk, _ in stale]).delete()
+
+
+class ProfilingMiddleware:
+    """
+    Profile selected requests and report the stored profile id in X-Profile-Id.
+    Requests that are not profiled pass straight through under both WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not should_profile(request):
+            return self.get_response(request)
+        return self.profile(request, self.get_response)
+
+    async def __acall__(self, request):
+        if not should_profile(request):
+            return await self.get_response(request)
+        # Run the rest of the chain from a worker thread: thread-sensitive ORM calls
+        # made under async_to_sync come back to this thread, so its profiler and
+        # execute wrapper see them
+        return await sync_to_async(self.profile, thread_sensitive=False)(request, async_to_sync(self.get_response))
+
+    def profile(self, request, get_response):
+        profiler, recorder = cProfile.Profile(), QueryRecorder()
+        start = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is already active in this thread
+                return get_response(request)
+            try:
+                response = get_response(request)
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - start
+
+        try:
+            profile = save_profile(request, response, profiler, recorder, duration)
+        except Exception:
+            logger.warning("Could not store request profile.", exc_info=True)
+        else:
+            response['X-Profile-Id'] = str(profile.pk)
+        return response
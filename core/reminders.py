@@ -0,0 +1,116 @@
+"""
+Payment reminder emails.
+
+The admin action queues a ReminderJob per pending settlement and
+`manage.py process_reminders` sends them in batches over one mail connection.
+A failed send goes back to pending with a doubling delay until it has been tried
+REMINDER_MAX_ATTEMPTS times; a batch whose worker died is taken over once its
+lease of REMINDER_LEASE_SECONDS runs out.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import ReminderJob
+
+logger = logging.getLogger(__name__)
+
+
+def reminder_message(settlement):
+    """
+    Build the (subject, message, from_email, recipient_list) tuple for a settlement reminder.
+    """
+    subject = 'Payment Reminder from PocketSense'
+    group_name = settlement.group.name if settlement.group else ''
+    message = f"""
+                    Hi {settlement.receiver.username},
+
+                    This is a reminder to settle the amount of ₹{settlement.amount} owed to {settlement.payer.username} for the expense in group "{group_name}".
+                    Please make the payment by {settlement.due_date} using your preferred payment method.
+                    """
+    return subject, message, settings.EMAIL_HOST_USER, [settlement.receiver.email]
+
+
+def queue_reminders(settlement_ids):
+    """
+    Queue a reminder for each settlement that has none waiting yet and return how
+    many were queued.
+    """
+    settlement_ids = list(settlement_ids)
+    waiting = set(
+        ReminderJob.objects.filter(settlement_id__in=settlement_ids, status__in=['pending', 'running'])
+        .values_list('settlement_id', flat=True)
+    )
+    jobs = ReminderJob.objects.bulk_create([
+        ReminderJob(settlement_id=pk) for pk in settlement_ids if pk not in waiting
+    ])
+    return len(jobs)
+
+
+def claim_reminders(batch_size):
+    """
+    Mark up to `batch_size` due reminders as running and return them, including
+    running ones whose lease has expired. Concurrent workers skip each other's
+    locked rows.
+    """
+    now = timezone.now()
+    expired = now - timedelta(seconds=settings.REMINDER_LEASE_SECONDS)
+    with transaction.atomic():
+        ids = list(
+            ReminderJob.objects.select_for_update(skip_locked=True)
+            .filter(Q(status='pending', run_after__lte=now) | Q(status='running', started_at__lt=expired))
+            .order_by('run_after').values_list('pk', flat=True)[:batch_size]
+        )
+        ReminderJob.objects.filter(pk__in=ids).update(status='running', started_at=now, attempts=F('attempts') + 1)
+    return list(
+        ReminderJob.objects.filter(pk__in=ids).select_related('settlement__payer', 'settlement__receiver',
+                                                                'settlement__group')
+    )
+
+
+def _failed(job, error, now):
+    job.error = str(error)
+    if job.attempts >= settings.REMINDER_MAX_ATTEMPTS:
+        job.status, job.finished_at = 'failed', now
+    else:
+        job.status = 'pending'
+        job.run_after = now + timedelta(seconds=settings.REMINDER_RETRY_DELAY * 2 ** (job.attempts - 1))
+
+
+def process_reminders(jobs):
+    """
+    Send a batch of claimed reminders over one mail connection. Reminders for
+    settlements paid in the meantime are cancelled.
+    """
+    if not jobs:
+        return
+    now = timezone.now()
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        logger.warning("Could not connect to the mail server.", exc_info=True)
+        for job in jobs:
+            _failed(job, e, now)
+    else:
+        try:
+            for job in jobs:
+                if job.settlement.payment_status:
+                    job.status, job.finished_at = 'cancelled', now
+                    continue
+                subject, message, from_email, recipient_list = reminder_message(job.settlement)
+                try:
+                    EmailMessage(subject, message, from_email, recipient_list, connection=connection).send()
+                except Exception as e:
+                    logger.warning("Failed to send reminder %s.", job.pk, exc_info=True)
+                    _failed(job, e, now)
+                else:
+                    job.status, job.error, job.finished_at = 'sent', '', now
+        finally:
+            connection.close()
+    ReminderJob.objects.bulk_update(jobs, ['status', 'error', 'run_after', 'finished_at'])
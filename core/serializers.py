@@ -1,5 +1,40 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
 from rest_framework import serializers
-from .models import Expense, Student, Group, Settlement, Category
+from .auth import get_student, member_group_ids
+from .models import Expense, Student, Group, Settlement, Category, ArchivedExpense, ArchivedSettlement, StatementJob
+from .events import expense_event, publish_group_event, settlement_event
+from .splits import group_members, split_amount, split_to_json, validate_split
+
+class RequestScopedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key field that only accepts objects the requesting student can see.
+    """
+
+    def scope(self, queryset, student):
+        raise NotImplementedError('.scope() must be overridden')
+
+    def get_queryset(self):
+        request = self.context.get('request')
+        queryset = super().get_queryset()
+        if request is None:  # Internal use without a request is not scoped
+            return queryset
+        return self.scope(queryset, get_student(request.user))
+
+class MemberGroupField(RequestScopedField):
+    def scope(self, queryset, student):
+        return queryset.filter(pk__in=member_group_ids(student))
+
+class ActiveMembersField(serializers.ManyRelatedField):
+    """
+    Group members, leaving out students pending deletion when reading. Filters in
+    Python so prefetched members are used.
+    """
+
+    def get_attribute(self, instance):
+        if not instance.pk:
+            return []
+        return [student for student in instance.members.all() if student.deletion_requested_at is None]
 
 class StudentSerializer(serializers.ModelSerializer):
     class Meta:
@@ -7,8 +42,10 @@ class StudentSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'college', 'semester', 'default_payment_methods']
 
 class GroupSerializer(serializers.ModelSerializer):
-    members = serializers.PrimaryKeyRelatedField(
-        many=True, queryset=Student.objects.all()
+    members = ActiveMembersField(
+        child_relation=serializers.PrimaryKeyRelatedField(
+            queryset=Student.objects.filter(deletion_requested_at__isnull=True)
+        )
     )  # Allow posting members as IDs, but still retrieve them as objects
 
     class Meta:
@@ -20,18 +57,82 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = ['id', 'name']
 
+def create_settlements(expenses):
+    """
+    Create the pending settlements owed to each expense's payer, for many expenses at once.
+    """
+    member_ids = {int(member_id) for expense in expenses for member_id in expense.members_split}
+    receivers = Student.objects.in_bulk(member_ids)
+    settlements = [
+        Settlement(
+            expense=expense,
+            group=expense.group,
+            payer=expense.payer,
+            receiver=receivers[int(member_id)],  # 'receiver' instead of 'payee'
+            amount=amount,
+            payment_status=False,
+            settlement_method='UPI'  # Default or based on logic
+        )
+        for expense in expenses
+        for member_id, amount in expense.members_split.items()
+        if int(member_id) in receivers and int(member_id) != expense.payer_id  # The payer doesn't owe themselves
+    ]
+    settlements = Settlement.objects.bulk_create(settlements)
+    # bulk_create skips post_save, so publish the live events here
+    for settlement in settlements:
+        publish_group_event(settlement.group_id, 'settlement.created', settlement_event(settlement))
+    return settlements
+
+class ExpenseListSerializer(serializers.ListSerializer):
+    """
+    Bulk expense import: splits and settlements for every item are computed in batches.
+    """
+
+    def validate(self, attrs):
+        members = group_members({item['group'].pk for item in attrs})
+        errors = []
+        for item in attrs:
+            member_ids = members[item['group'].pk]
+            if item['payer'].pk not in member_ids:
+                errors.append({'payer_id': ["The payer must be a member of the group."]})
+                continue
+            try:
+                if 'members_split' in item:
+                    item['members_split'] = validate_split(item['amount'], item['members_split'], member_ids)
+                else:
+                    split = split_amount(item['amount'], item['split_type'], member_ids, item.get('weights'))
+                    item['members_split'] = split_to_json(split)
+                errors.append({})
+            except DjangoValidationError as e:
+                errors.append({'members_split': e.messages})
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return attrs
+
+    @transaction.atomic
+    def create(self, validated_data):
+        expenses = Expense.objects.bulk_create([
+            Expense(**{key: value for key, value in item.items() if key != 'weights'})
+            for item in validated_data
+        ])
+        for expense in expenses:
+            publish_group_event(expense.group_id, 'expense.created', expense_event(expense))
+        create_settlements(expenses)
+        return expenses
+
 class ExpenseSerializer(serializers.ModelSerializer):
-    group_id = serializers.PrimaryKeyRelatedField(
-        queryset=Group.objects.all(),
+    group_id = MemberGroupField(
+        queryset=Group.objects.filter(deletion_requested_at__isnull=True),
         source='group',  # Maps to the `group` field in the model
         write_only=True
     )
     payer_id = serializers.PrimaryKeyRelatedField(
-        queryset=Student.objects.all(),
-        source='payer',  # Maps to the `payer` field in the model
+        queryset=Student.objects.filter(deletion_requested_at__isnull=True),
+        source='payer',  # Maps to the `payer` field in the model; must be a member of the group (see validate)
         write_only=True
     )
-    members_split = serializers.JSONField(write_only=True)  # Used for input only
+    members_split = serializers.JSONField(write_only=True, required=False)  # Computed from split_type when omitted
+    weights = serializers.JSONField(write_only=True, required=False)  # {member_id: weight} for proportional splits
 
     # Read-only fields
     group = GroupSerializer(read_only=True)
@@ -43,32 +144,74 @@ class ExpenseSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Expense
-        fields = ['id', 'group_id', 'payer_id', 'amount', 'category', 'split_type', 'members_split', 'group', 'payer']
+        fields = ['id', 'group_id', 'payer_id', 'amount', 'category', 'split_type', 'members_split', 'weights', 'group', 'payer']
+        list_serializer_class = ExpenseListSerializer
+
+    def validate(self, attrs):
+        """
+        Validate an explicit members_split, or compute one from split_type and the group members.
+        Updates recompute the split when the amount, split type, weights or group change.
+        Bulk imports check and compute splits in one batch in ExpenseListSerializer instead.
+        """
+        if isinstance(self.parent, serializers.ListSerializer):
+            return attrs
+        group = self._value(attrs, 'group')
+        payer = self._value(attrs, 'payer')
+        member_ids = list(group.members.values_list('id', flat=True)) if group else []
+        if payer is not None and payer.pk not in member_ids:
+            raise serializers.ValidationError({'payer_id': ["The payer must be a member of the group."]})
+        try:
+            if 'members_split' in attrs:
+                attrs['members_split'] = validate_split(self._value(attrs, 'amount'), attrs['members_split'], member_ids)
+            elif self.instance is None or 'weights' in attrs or self._changed(attrs, 'amount', 'split_type', 'group'):
+                split = split_amount(self._value(attrs, 'amount'), self._value(attrs, 'split_type'), member_ids,
+                                     attrs.get('weights'))
+                attrs['members_split'] = split_to_json(split)
+        except DjangoValidationError as e:
+            raise serializers.ValidationError({'members_split': e.messages})
+        if self.settlements_change(attrs) and self.instance.settlements.filter(payment_status=True).exists():
+            raise serializers.ValidationError(
+                {'members_split': ["The split of an expense with paid settlements cannot be changed."]}
+            )
+        return attrs
+
+    def _value(self, attrs, field):
+        return attrs[field] if field in attrs else getattr(self.instance, field, None)
+
+    def _changed(self, attrs, *fields):
+        return self.instance is not None and any(
+            field in attrs and attrs[field] != getattr(self.instance, field) for field in fields
+        )
+
+    def settlements_change(self, attrs):
+        """
+        Whether saving `attrs` changes who owes what on an existing expense.
+        """
+        return self._changed(attrs, 'members_split', 'payer', 'group')
 
+    @transaction.atomic
     def create(self, validated_data):
         """
         Custom create method to handle members_split for settlements creation.
         """
-        members_split = validated_data.pop('members_split', None)
+        validated_data.pop('weights', None)
         expense = super().create(validated_data)
 
         # Create settlements based on members_split
-        if members_split:
-            for member_id, amount in members_split.items():
-                try:
-                    receiver  = Student.objects.get(id=member_id)
-                except Student.DoesNotExist:
-                    continue  # Optionally handle this case
-
-                Settlement.objects.create(
-                    expense=expense,
-                    group=validated_data['group'],
-                    payer=validated_data['payer'],
-                    receiver=receiver,  # 'receiver' instead of 'payee'
-                    amount=amount,
-                    payment_status= False,
-                    settlement_method='UPI'  # Default or based on logic
-                )
+        create_settlements([expense])
+        return expense
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        """
+        Save the changes and rebuild the pending settlements if the split, payer or group changed.
+        """
+        validated_data.pop('weights', None)
+        rebuild = self.settlements_change(validated_data)
+        expense = super().update(instance, validated_data)
+        if rebuild:
+            expense.settlements.filter(payment_status=False).delete()
+            create_settlements([expense])
         return expense
 
 class SettlementSerializer(serializers.ModelSerializer):
@@ -80,3 +223,40 @@ class SettlementSerializer(serializers.ModelSerializer):
     class Meta:
         model = Settlement
         fields = ['id', 'group', 'expense', 'payer', 'receiver', 'amount', 'payment_status']
+
+class ArchivedExpenseSerializer(serializers.ModelSerializer):
+    group = GroupSerializer(read_only=True)
+    payer = StudentSerializer(read_only=True)
+    category = serializers.SlugRelatedField(slug_field='name', read_only=True)
+    archived = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ArchivedExpense
+        fields = ['id', 'amount', 'category', 'split_type', 'group', 'payer', 'archived']
+
+    def get_archived(self, obj):
+        return True
+
+class ArchivedSettlementSerializer(serializers.ModelSerializer):
+    group = GroupSerializer(read_only=True)
+    expense = ArchivedExpenseSerializer(read_only=True)
+    payer = StudentSerializer(read_only=True)
+    receiver = StudentSerializer(read_only=True)
+    archived = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ArchivedSettlement
+        fields = ['id', 'group', 'expense', 'payer', 'receiver', 'amount', 'payment_status', 'archived']
+
+    def get_archived(self, obj):
+        return True
+
+class StatementJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StatementJob
+        fields = ['id', 'subject_type', 'subject_id', 'month', 'file_format', 'status', 'data_version', 'error',
+                  'created_at', 'finished_at']
+        read_only_fields = ['status', 'data_version', 'error', 'created_at', 'finished_at']
+
+    def validate_month(self, value):
+        return value.replace(day=1)
@@ -0,0 +1,109 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .events import expense_event, publish_group_event, settlement_event
+from .models import Expense, Group, GroupJoin, Settlement, Tombstone
+
+_tombstones_enabled = ContextVar('tombstones_enabled', default=True)
+
+
+@contextmanager
+def tombstones_disabled():
+    """
+    Skip the per-row tombstones of deletes in this block, for rows that are moved
+    (archived) or whose tombstones the caller writes itself in bulk.
+    """
+    token = _tombstones_enabled.set(False)
+    try:
+        yield
+    finally:
+        _tombstones_enabled.reset(token)
+
+
+@receiver(post_save, sender=Expense)
+def expense_saved(sender, instance, created, **kwargs):
+    if created:
+        publish_group_event(instance.group_id, 'expense.created', expense_event(instance))
+
+
+@receiver(post_init, sender=Settlement)
+def settlement_loaded(sender, instance, **kwargs):
+    # Remember the loaded status so a save can tell when a settlement becomes paid
+    instance._loaded_payment_status = instance.payment_status
+
+
+@receiver(post_save, sender=Settlement)
+def settlement_saved(sender, instance, created, **kwargs):
+    if created:
+        publish_group_event(instance.group_id, 'settlement.created', settlement_event(instance))
+    elif instance.payment_status and not instance._loaded_payment_status:
+        publish_group_event(instance.group_id, 'settlement.paid', settlement_event(instance))
+    instance._loaded_payment_status = instance.payment_status
+
+
+@receiver(post_delete, sender=Expense)
+def expense_deleted(sender, instance, **kwargs):
+    if _tombstones_enabled.get():
+        Tombstone.objects.create(model='expense', object_id=instance.pk, group_id=instance.group_id)
+
+
+@receiver(post_delete, sender=Settlement)
+def settlement_deleted(sender, instance, **kwargs):
+    if _tombstones_enabled.get():
+        Tombstone.objects.create(model='settlement', object_id=instance.pk, group_id=instance.group_id)
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    # Membership rows are gone by post_delete, so remember who needs to be told
+    instance._member_ids = list(instance.members.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    if not _tombstones_enabled.get():
+        return
+    Tombstone.objects.bulk_create([
+        Tombstone(model='group', object_id=instance.pk, student_id=student_id)
+        for student_id in getattr(instance, '_member_ids', ())
+    ])
+
+
+@receiver(m2m_changed, sender=Group.members.through)
+def group_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Bump the group's updated_at when its members change, record joins so new
+    members are sent the group's history, and tombstone the group for members who
+    leave it.
+    """
+    if action == 'pre_clear':
+        # pk_set is None for clear(), so capture the pairs being removed
+        memberships = Group.members.through.objects.filter(
+            **{'student_id' if reverse else 'group_id': instance.pk}
+        ).values_list('group_id', 'student_id')
+        instance._cleared_memberships = list(memberships)
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if action == 'post_clear':
+        memberships = getattr(instance, '_cleared_memberships', [])
+    elif reverse:
+        memberships = [(group_id, instance.pk) for group_id in pk_set]
+    else:
+        memberships = [(instance.pk, student_id) for student_id in pk_set]
+
+    Group.objects.filter(pk__in={group_id for group_id, _ in memberships}).update(updated_at=timezone.now())
+    if action == 'post_add':
+        GroupJoin.objects.bulk_create([
+            GroupJoin(group_id=group_id, student_id=student_id) for group_id, student_id in memberships
+        ])
+    else:
+        Tombstone.objects.bulk_create([
+            Tombstone(model='group', object_id=group_id, student_id=student_id)
+            for group_id, student_id in memberships
+        ])
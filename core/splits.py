@@ -0,0 +1,128 @@
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+
+from .models import Group
+
+CENT = Decimal('0.01')
+
+
+def _to_decimal(value, label):
+    try:
+        value = Decimal(str(value))
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValidationError(f"{label} must be a number.")
+    if not value.is_finite():
+        raise ValidationError(f"{label} must be a finite number.")
+    return value
+
+
+def _member_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValidationError(f"'{value}' is not a member id.")
+
+
+def group_members(group_ids):
+    """
+    {group_id: [student_id, ...]} for the given groups, in one query.
+    """
+    members = defaultdict(list)
+    memberships = Group.members.through.objects.filter(group_id__in=group_ids).values_list('group_id', 'student_id')
+    for group_id, student_id in memberships:
+        members[group_id].append(student_id)
+    return members
+
+
+def split_amount(amount, split_type, members, weights=None):
+    """
+    Split `amount` between `members` and return {member_id: Decimal share}.
+
+    Shares are whole paise and always add up to `amount`. Leftover paise go to the
+    members with the largest fractional share, ties broken by ascending member id,
+    so the same input always produces the same split.
+    """
+    amount = _to_decimal(amount, "Amount")
+    if amount <= 0 or amount != amount.quantize(CENT):
+        raise ValidationError("Amount must be positive with at most two decimal places.")
+    members = sorted({int(member) for member in members})
+    if not members:
+        raise ValidationError("The group has no members to split between.")
+
+    if split_type == 'equal':
+        weights = {member: Decimal(1) for member in members}
+    elif split_type == 'proportional':
+        if not weights:
+            raise ValidationError("Proportional splits require weights.")
+        if not isinstance(weights, dict):
+            raise ValidationError("Weights should be a dictionary of member id to weight.")
+        weights = {
+            _member_id(member): _to_decimal(weight, f"Weight for member {member}") for member, weight in weights.items()
+        }
+        unknown = set(weights) - set(members)
+        if unknown:
+            raise ValidationError(f"Weights given for non-members: {sorted(unknown)}.")
+        if any(weight < 0 for weight in weights.values()):
+            raise ValidationError("Weights cannot be negative.")
+        weights = {member: weights.get(member, Decimal(0)) for member in members}
+    else:
+        raise ValidationError(f"Unknown split type '{split_type}'.")
+
+    total_weight = sum(weights.values())
+    if total_weight <= 0:
+        raise ValidationError("Weights must add up to more than zero.")
+
+    total = int(amount / CENT)
+    shares, remainders = {}, {}
+    for member in members:
+        shares[member], remainders[member] = divmod(total * weights[member], total_weight)
+    leftover = total - int(sum(shares.values()))
+    for member in sorted(members, key=lambda m: (-remainders[m], m))[:leftover]:
+        shares[member] += 1
+
+    return {member: (Decimal(int(share)) * CENT) for member, share in shares.items() if share}
+
+
+def split_expenses(expenses, weights=None):
+    """
+    Compute splits for many expenses at once. `expenses` are (possibly unsaved)
+    Expense instances; the members of every group involved are fetched in a
+    single query. `weights` is an optional list parallel to `expenses`.
+    """
+    expenses = list(expenses)
+    weights = weights or [None] * len(expenses)
+    members = group_members({expense.group_id for expense in expenses})
+    return [
+        split_amount(expense.amount, expense.split_type, members[expense.group_id], expense_weights)
+        for expense, expense_weights in zip(expenses, weights)
+    ]
+
+
+def validate_split(amount, members_split, members):
+    """
+    Check that an explicit members_split only has positive shares in whole paise for
+    members of the group, adding up to `amount`. Returns the split in its stored form.
+    """
+    if not isinstance(members_split, dict):
+        raise ValidationError("members_split should be a dictionary.")
+    shares = {
+        _member_id(member): _to_decimal(share, f"Amount for member {member}") for member, share in members_split.items()
+    }
+    unknown = set(shares) - {int(member) for member in members}
+    if unknown:
+        raise ValidationError(f"members_split has shares for non-members: {sorted(unknown)}.")
+    for member, share in shares.items():
+        if share <= 0 or share != share.quantize(CENT):
+            raise ValidationError(f"Amount for member {member} must be positive with at most two decimal places.")
+    if sum(shares.values()) != _to_decimal(amount, "Amount"):
+        raise ValidationError("members_split amounts must add up to the expense amount.")
+    return split_to_json(shares)
+
+
+def split_to_json(split):
+    """
+    Convert a computed split into the form stored in Expense.members_split.
+    """
+    return {str(member): str(share) for member, share in split.items()}
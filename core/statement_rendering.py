@@ -0,0 +1,103 @@
+"""
+Rendering of monthly statements to CSV and PDF.
+
+These functions only take plain data and return bytes so they can run in worker
+processes without Django or a database connection.
+"""
+import csv
+import io
+
+PDF_LINES_PER_PAGE = 60
+
+
+def statement_lines(data):
+    """
+    Lay out a statement as plain text lines.
+    """
+    lines = [data['title'], '']
+    lines.append('Expenses')
+    lines.append(f"{'Date':<12}{'Group':<20}{'Category':<16}{'Paid by':<16}{'Amount':>12}")
+    for day, group, category, payer, amount in data['expenses']:
+        lines.append(f"{day:<12}{group[:19]:<20}{category[:15]:<16}{payer[:15]:<16}{amount:>12}")
+    lines.append(f"{'Total':<64}{data['total']:>12}")
+    lines.append('')
+    lines.append('Settlements')
+    lines.append(f"{'Due':<12}{'Owed to':<16}{'Owed by':<16}{'Status':<20}{'Amount':>12}")
+    for due, payer, receiver, amount, settled in data['settlements']:
+        lines.append(f"{due:<12}{payer[:15]:<16}{receiver[:15]:<16}{settled:<20}{amount:>12}")
+    lines.append('')
+    lines.append('By category')
+    for category, amount in data['category_totals']:
+        lines.append(f"{category[:63]:<64}{amount:>12}")
+    return lines
+
+
+def render_csv(data):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([data['title']])
+    writer.writerow([])
+    writer.writerow(['section', 'date', 'group', 'category', 'payer', 'receiver', 'amount', 'status'])
+    for day, group, category, payer, amount in data['expenses']:
+        writer.writerow(['expense', day, group, category, payer, '', amount, ''])
+    for due, payer, receiver, amount, settled in data['settlements']:
+        writer.writerow(['settlement', due, '', '', payer, receiver, amount, settled])
+    for category, amount in data['category_totals']:
+        writer.writerow(['category_total', '', '', category, '', '', amount, ''])
+    writer.writerow(['total', '', '', '', '', '', data['total'], ''])
+    return buffer.getvalue().encode()
+
+
+def _pdf_text(line):
+    text = line.encode('latin-1', 'replace').decode('latin-1')
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def render_pdf(data):
+    """
+    Render a minimal text-only PDF in a monospaced font.
+    """
+    lines = statement_lines(data)
+    pages = [lines[i:i + PDF_LINES_PER_PAGE] for i in range(0, len(lines), PDF_LINES_PER_PAGE)] or [[]]
+
+    # Object 1 is the catalog, 2 the page tree, 3 the font; each page adds a page and a content object
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>", 3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier >>"}
+    kids = []
+    for index, page in enumerate(pages):
+        page_id, content_id = 4 + index * 2, 5 + index * 2
+        kids.append(f"{page_id} 0 R")
+        text = "\n".join(f"({_pdf_text(line)}) Tj T*" for line in page)
+        stream = f"BT /F1 9 Tf 11 TL 36 806 Td\n{text}\nET".encode('latin-1')
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode()
+        objects[content_id] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(pages)} >>".encode()
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number in sorted(objects):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n" % number + objects[number] + b"\nendobj\n")
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(offsets) + 1))
+    for offset in offsets:
+        output.write(b"%010d 00000 n \n" % offset)
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(offsets) + 1, xref))
+    return output.getvalue()
+
+
+RENDERERS = {
+    'csv': render_csv,
+    'pdf': render_pdf,
+}
+
+
+def render_statement(job):
+    """
+    Render one (format, data) pair. Used as the process pool entry point.
+    """
+    file_format, data = job
+    return RENDERERS[file_format](data)
@@ -0,0 +1,204 @@
+import hashlib
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Q
+from django.utils import timezone
+
+from .models import Expense, Group, Settlement, StatementJob, Student
+from .statement_rendering import render_statement
+
+
+def month_bounds(month):
+    start = month.replace(day=1)
+    return start, date(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def expense_filter(subject_type, subject_id, month):
+    start, end = month_bounds(month)
+    subject = Q(group_id=subject_id) if subject_type == 'group' else Q(payer_id=subject_id)
+    return subject & Q(date__gte=start, date__lt=end)
+
+
+def settlement_filter(subject_type, subject_id, month):
+    """
+    Settlements of an expense dated in the month, or standalone settlements due in it.
+    """
+    start, end = month_bounds(month)
+    if subject_type == 'group':
+        subject = Q(group_id=subject_id)
+    else:
+        subject = Q(payer_id=subject_id) | Q(receiver_id=subject_id)
+    period = (
+        Q(expense__date__gte=start, expense__date__lt=end)
+        | Q(expense__isnull=True, due_date__gte=start, due_date__lt=end)
+    )
+    return subject & period
+
+
+def data_version(expense_count, expense_updated, settlement_count, settlement_updated):
+    """
+    Identify the state of a statement's rows by their count and latest update.
+    """
+    stamp = f"{expense_count}|{expense_updated}|{settlement_count}|{settlement_updated}"
+    return hashlib.sha256(stamp.encode()).hexdigest()[:16]
+
+
+def current_version(subject_type, subject_id, month):
+    expenses = Expense.objects.filter(expense_filter(subject_type, subject_id, month)).aggregate(
+        count=Count('id'), updated=Max('updated_at')
+    )
+    settlements = Settlement.objects.filter(settlement_filter(subject_type, subject_id, month)).aggregate(
+        count=Count('id'), updated=Max('updated_at')
+    )
+    return data_version(expenses['count'], expenses['updated'], settlements['count'], settlements['updated'])
+
+
+def statement_path(job, version):
+    name = f"{job.subject_type}-{job.subject_id}-{job.month:%Y-%m}-{version}.{job.file_format}"
+    return Path(settings.STATEMENT_DIR) / name
+
+
+def use_cached_file(job):
+    """
+    Finish `job` straight away if a file for the current data version is already on disk.
+    """
+    version = current_version(job.subject_type, job.subject_id, job.month)
+    path = statement_path(job, version)
+    if not path.exists():
+        return False
+    job.status, job.data_version, job.file_path = 'done', version, str(path)
+    job.finished_at = timezone.now()
+    return True
+
+
+def claim_jobs(batch_size):
+    """
+    Mark up to `batch_size` pending jobs as running and return them, including
+    running ones whose lease has expired. Expired jobs already tried
+    STATEMENT_MAX_ATTEMPTS times are failed instead. Concurrent workers skip each
+    other's locked rows.
+    """
+    now = timezone.now()
+    expired = Q(status='running', started_at__lt=now - timedelta(seconds=settings.STATEMENT_LEASE_SECONDS))
+    with transaction.atomic():
+        StatementJob.objects.filter(expired, attempts__gte=settings.STATEMENT_MAX_ATTEMPTS).update(
+            status='failed', error="The worker stopped while rendering this statement.", finished_at=now
+        )
+        ids = list(
+            StatementJob.objects.select_for_update(skip_locked=True)
+            .filter(Q(status='pending') | expired).order_by('created_at').values_list('pk', flat=True)[:batch_size]
+        )
+        StatementJob.objects.filter(pk__in=ids).update(status='running', started_at=now, attempts=F('attempts') + 1)
+    return list(StatementJob.objects.filter(pk__in=ids))
+
+
+def _fetch_rows(jobs):
+    """
+    Fetch the expenses and settlements of every job in the batch with one query each,
+    indexed by (subject_type, subject_id, month).
+    """
+    expense_rows = Expense.objects.filter(
+        reduce(or_, (expense_filter(job.subject_type, job.subject_id, job.month) for job in jobs))
+    ).order_by('date', 'pk').values(
+        'group_id', 'payer_id', 'date', 'amount', 'updated_at', 'group__name', 'category__name', 'payer__username',
+    )
+    settlement_rows = Settlement.objects.filter(
+        reduce(or_, (settlement_filter(job.subject_type, job.subject_id, job.month) for job in jobs))
+    ).order_by('due_date', 'pk').values(
+        'group_id', 'payer_id', 'receiver_id', 'amount', 'payment_status', 'due_date', 'updated_at', 'expense__date',
+        'payer__username', 'receiver__username',
+    )
+
+    expenses, settlements = defaultdict(list), defaultdict(list)
+    for row in expense_rows:
+        month = row['date'].replace(day=1)
+        expenses['group', row['group_id'], month].append(row)
+        expenses['student', row['payer_id'], month].append(row)
+    for row in settlement_rows:
+        month = (row['expense__date'] or row['due_date']).replace(day=1)
+        settlements['group', row['group_id'], month].append(row)
+        settlements['student', row['payer_id'], month].append(row)
+        settlements['student', row['receiver_id'], month].append(row)
+    return expenses, settlements
+
+
+def _statement_data(job, name, expenses, settlements):
+    category_totals = defaultdict(Decimal)
+    for row in expenses:
+        category_totals[row['category__name']] += row['amount']
+    return {
+        'title': f"PocketSense statement - {job.subject_type} {name} - {job.month:%Y-%m}",
+        'expenses': [
+            (str(row['date']), row['group__name'], row['category__name'], row['payer__username'], str(row['amount']))
+            for row in expenses
+        ],
+        'settlements': [
+            (str(row['due_date'] or ''), row['payer__username'], row['receiver__username'], str(row['amount']),
+             'Settled' if row['payment_status'] else 'Pending')
+            for row in settlements
+        ],
+        'category_totals': sorted(
+            ((category, str(total)) for category, total in category_totals.items()), key=lambda item: item[0]
+        ),
+        'total': str(sum((row['amount'] for row in expenses), Decimal('0.00'))),
+    }
+
+
+def process_jobs(jobs, workers=None):
+    """
+    Render a batch of claimed jobs. Data for the whole batch is fetched up front,
+    files already on disk for the same data version are reused, and the rest are
+    rendered in parallel on a process pool.
+    """
+    if not jobs:
+        return
+    expenses, settlements = _fetch_rows(jobs)
+    names = {
+        'group': {pk: group.name for pk, group in Group.objects.in_bulk(
+            [job.subject_id for job in jobs if job.subject_type == 'group']).items()},
+        'student': {pk: student.username for pk, student in Student.objects.in_bulk(
+            [job.subject_id for job in jobs if job.subject_type == 'student']).items()},
+    }
+
+    to_render = []
+    for job in jobs:
+        key = (job.subject_type, job.subject_id, job.month.replace(day=1))
+        job_expenses, job_settlements = expenses.get(key, []), settlements.get(key, [])
+        job.data_version = data_version(
+            len(job_expenses), max((row['updated_at'] for row in job_expenses), default=None),
+            len(job_settlements), max((row['updated_at'] for row in job_settlements), default=None),
+        )
+        path = statement_path(job, job.data_version)
+        if path.exists():
+            job.status, job.file_path = 'done', str(path)
+        else:
+            name = names[job.subject_type].get(job.subject_id, job.subject_id)
+            to_render.append((job, path, (job.file_format, _statement_data(job, name, job_expenses, job_settlements))))
+
+    if to_render:
+        Path(settings.STATEMENT_DIR).mkdir(parents=True, exist_ok=True)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [(job, path, pool.submit(render_statement, payload)) for job, path, payload in to_render]
+            for job, path, future in futures:
+                try:
+                    content = future.result()
+                    partial = path.with_suffix(path.suffix + '.part')
+                    partial.write_bytes(content)
+                    os.replace(partial, path)
+                    job.status, job.file_path = 'done', str(path)
+                except Exception as e:
+                    job.status, job.error = 'failed', str(e)
+
+    now = timezone.now()
+    for job in jobs:
+        job.finished_at = now
+    StatementJob.objects.bulk_update(jobs, ['status', 'data_version', 'file_path', 'error', 'finished_at'])
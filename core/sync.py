@@ -0,0 +1,177 @@
+import base64
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .auth import member_group_ids, without_pending_students
+from .models import Expense, Group, GroupJoin, Settlement, Tombstone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# Stream name -> (timestamp field) for every kind of change a client syncs
+STREAMS = {
+    'groups': 'updated_at',
+    'expenses': 'updated_at',
+    'settlements': 'updated_at',
+    'deleted': 'deleted_at',
+    'joined': 'joined_at',
+}
+
+# Streams whose history is sent to students joining a group
+CATCHUP_STREAMS = ('expenses', 'settlements')
+
+
+class InvalidSyncToken(ValueError):
+    pass
+
+
+class SyncTokenExpired(InvalidSyncToken):
+    """
+    The token predates SYNC_RETENTION_DAYS, so deletions since then may have been pruned.
+    """
+
+
+def _encode_position(position):
+    moment, pk = position
+    return [moment.isoformat(), pk]
+
+
+def _decode_position(value):
+    return datetime.fromisoformat(value[0]), int(value[1])
+
+
+def encode_token(positions, catchup=None):
+    """
+    Encode per-stream (timestamp, id) positions into an opaque sync token.
+    `catchup` maps a joined group id to {stream: (from position, until position)}
+    for history still to be sent.
+    """
+    payload = {stream: _encode_position(position) for stream, position in positions.items()}
+    payload['issued'] = timezone.now().isoformat()
+    if catchup:
+        payload['catchup'] = {
+            str(group_id): {stream: [_encode_position(start), _encode_position(until)]
+                            for stream, (start, until) in streams.items()}
+            for group_id, streams in catchup.items()
+        }
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_token(token):
+    """
+    Decode a sync token into (positions, catchup). An empty token starts a full sync.
+    """
+    if not token:
+        return {stream: (EPOCH, 0) for stream in STREAMS}, {}
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        issued = datetime.fromisoformat(payload['issued']) if 'issued' in payload else None
+        positions = {stream: _decode_position(payload[stream]) for stream in STREAMS}
+        catchup = {
+            int(group_id): {stream: (_decode_position(start), _decode_position(until))
+                            for stream, (start, until) in streams.items() if stream in CATCHUP_STREAMS}
+            for group_id, streams in payload.get('catchup', {}).items()
+        }
+    except (ValueError, KeyError, TypeError, IndexError, AttributeError):
+        raise InvalidSyncToken("Invalid sync token.")
+    if issued and issued < retention_cutoff():
+        raise SyncTokenExpired("Sync token expired, start a full sync.")
+    return positions, catchup
+
+
+def retention_cutoff():
+    return timezone.now() - timedelta(days=settings.SYNC_RETENTION_DAYS)
+
+
+def prune_sync_records():
+    """
+    Delete tombstones and join records older than SYNC_RETENTION_DAYS. Tokens issued
+    before then are rejected, so no client still needs them. Returns the rows deleted.
+    """
+    cutoff = retention_cutoff()
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    joins, _ = GroupJoin.objects.filter(joined_at__lt=cutoff).delete()
+    return deleted + joins
+
+
+def _after(field, position):
+    moment, pk = position
+    return Q(**{f'{field}__gt': moment}) | Q(**{field: moment, 'pk__gt': pk})
+
+
+def stream_querysets(student):
+    """
+    The rows each stream covers for `student`: everything in the student's groups,
+    plus tombstones addressed to the student.
+    """
+    group_ids = member_group_ids(student)
+    return {
+        'groups': Group.objects.filter(pk__in=group_ids).prefetch_related('members'),
+        'expenses': Expense.objects.filter(without_pending_students('payer'), group_id__in=group_ids)
+        .select_related('group', 'payer', 'category').prefetch_related('group__members'),
+        'settlements': Settlement.objects.filter(
+            without_pending_students('payer', 'receiver', 'expense__payer'), group_id__in=group_ids
+        ).select_related('group', 'payer', 'receiver', 'expense__group', 'expense__payer', 'expense__category')
+        .prefetch_related('group__members', 'expense__group__members'),
+        'deleted': Tombstone.objects.filter(Q(group_id__in=group_ids) | Q(student_id=student.pk)),
+        'joined': GroupJoin.objects.filter(student_id=student.pk, group_id__in=group_ids),
+    }
+
+
+def changes_since(student, token, page_size=None):
+    """
+    Return ({stream: [rows]}, next_token, has_more) for rows changed after `token`.
+
+    Each stream is paged by (timestamp, id) keyset. Rows changed in the last
+    SYNC_SAFETY_WINDOW_SECONDS are held back until a later call so rows saved by
+    transactions still in flight are not skipped.
+
+    A group the student joined after their cursor gets its own catch-up cursor in
+    the token, which pages through its expenses and settlements up to where the
+    main cursor stood at the time of the join.
+    """
+    page_size = page_size or settings.SYNC_PAGE_SIZE
+    positions, catchup = decode_token(token)
+    previous = dict(positions)
+    upper = timezone.now() - timedelta(seconds=settings.SYNC_SAFETY_WINDOW_SECONDS)
+    querysets = stream_querysets(student)
+
+    results, has_more = {}, False
+    for stream, queryset in querysets.items():
+        field = STREAMS[stream]
+        rows = list(
+            queryset.filter(_after(field, positions[stream]))
+            .filter(**{f'{field}__lte': upper})
+            .order_by(field, 'pk')[:page_size + 1]
+        )
+        if len(rows) > page_size:
+            rows, has_more = rows[:page_size], True
+        if rows:
+            positions[stream] = (getattr(rows[-1], field), rows[-1].pk)
+        results[stream] = rows
+
+    for join in results.pop('joined'):
+        for stream in CATCHUP_STREAMS:
+            if previous[stream][0] > EPOCH:  # A full sync already includes the group's history
+                catchup.setdefault(join.group_id, {})[stream] = ((EPOCH, 0), previous[stream])
+
+    for group_id, streams in list(catchup.items()):
+        for stream, (start, until) in list(streams.items()):
+            field = STREAMS[stream]
+            rows = list(
+                querysets[stream].filter(group_id=group_id).filter(_after(field, start))
+                .exclude(_after(field, until))
+                .order_by(field, 'pk')[:page_size + 1]
+            )
+            if len(rows) > page_size:
+                rows, has_more = rows[:page_size], True
+                streams[stream] = ((getattr(rows[-1], field), rows[-1].pk), until)
+            else:
+                del streams[stream]
+            results[stream].extend(rows)
+        if not streams:
+            del catchup[group_id]
+    return results, encode_token(positions, catchup), has_more
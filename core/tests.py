@@ -1,6 +1,38 @@
+import json
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+import tempfile
+from unittest import mock
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth.models import User
+from django.core import mail
+from django.conf import settings
+from django.core.cache.backends.redis import RedisCache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test.utils import CaptureQueriesContext
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.test import APITestCase
 from rest_framework import status
-from .models import Student, Group
+from .models import (
+    Student, Group, Expense, Category, Settlement, ArchivedExpense, ArchivedSettlement, StatementJob, RequestProfile,
+    ReminderJob, Tombstone,
+)
+from . import throttling
+from .admin import EstimatedCountPaginator
+from .auth import member_group_ids
+from .events import get_broker, group_channel
+from .middleware import ThrottleHeadersMiddleware
+from .profiling import ProfilingMiddleware, make_token
+from pocketsense.schema import generate_schema, load_schema, schema_path
+from .reminders import claim_reminders, process_reminders, queue_reminders
+from .splits import split_amount
+from .statements import claim_jobs
 
 class GroupTestCase(APITestCase):
     def setUp(self):
@@ -34,3 +66,781 @@ class GroupTestCase(APITestCase):
         self.assertEqual(response_data['name'], payload['name'])
         self.assertEqual(response_data['group_type'], payload['group_type'])
         self.assertEqual(len(response_data['members']), len(payload['members']))
+
+class SpendingTrendsTestCase(APITestCase):
+    def setUp(self):
+        throttling.store.local.clear()  # Trends requests are costly for the route throttle
+        self.student = Student.objects.create_user(
+            username="student1", password="password123", email="student1@example.com", semester=1
+        )
+        self.group = Group.objects.create(name="Flat", group_type="friends")
+        self.group.members.add(self.student)
+        self.category = Category.objects.create(name="Food")
+        self.client.force_authenticate(self.student)
+
+    def _expense(self, amount, day):
+        expense = Expense.objects.create(
+            amount=Decimal(amount), category=self.category, split_type='equal',
+            group=self.group, payer=self.student,
+        )
+        Expense.objects.filter(pk=expense.pk).update(date=day)
+        return expense
+
+    def test_monthly_totals_and_anomalies(self):
+        for i in range(12):
+            self._expense("100.00", date(2025, 1, i + 1))
+        self._expense("50.50", date(2025, 2, 3))
+        outlier = self._expense("5000.00", date(2025, 3, 1))
+
+        response = self.client.get('/analysis/trends/', {'start_month': '2025-01', 'end_month': '2025-03'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data['months'], ['2025-01', '2025-02', '2025-03'])
+        self.assertEqual(data['groups'][0]['totals'], [1200.0, 50.5, 5000.0])
+        self.assertEqual(data['groups'][0]['rolling_average'], [1200.0, 625.25, 2083.5])
+        self.assertEqual(data['groups'][0]['percentiles']['p50'], 100.0)
+        self.assertEqual(data['categories'][0]['name'], 'Food')
+        self.assertEqual([a['expense_id'] for a in data['anomalies']], [outlier.id])
+
+    def test_small_group_outlier_flagged(self):
+        for amount in ["100.00", "95.00", "105.00", "98.00", "102.00"]:
+            self._expense(amount, date(2025, 1, 5))
+        outlier = self._expense("900.00", date(2025, 1, 6))
+
+        response = self.client.get('/analysis/trends/', {'start_month': '2025-01', 'end_month': '2025-01'})
+        self.assertEqual([a['expense_id'] for a in response.json()['anomalies']], [outlier.id])
+
+    def test_invalid_month(self):
+        response = self.client.get('/analysis/trends/', {'start_month': '2025-13'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for params in [{'group': 'abc'}, {'start_month': '0000-01'}, {'threshold': 'nan'},
+                       {'start_month': '0001-01', 'end_month': '9999-11'}, {'start_month': '2015-01', 'end_month': '2025-01'}]:
+            response = self.client.get('/analysis/trends/', params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+        throttling.store.local.clear()
+        response = self.client.get('/analysis/trends/', {'start_month': '2015-02', 'end_month': '2025-01'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)  # Exactly 120 months
+
+class SplitEngineTestCase(APITestCase):
+    def setUp(self):
+        self.students = [
+            Student.objects.create_user(username=f"student{i}", password="password123", semester=1)
+            for i in range(3)
+        ]
+        self.group = Group.objects.create(name="Trip", group_type="friends")
+        self.group.members.set(self.students)
+        self.category = Category.objects.create(name="Travel")
+        self.client.force_authenticate(self.students[0])
+
+    def test_equal_split_allocates_pennies_deterministically(self):
+        ids = [s.id for s in self.students]
+        split = split_amount(Decimal("100.00"), 'equal', reversed(ids))
+        self.assertEqual(split, {ids[0]: Decimal("33.34"), ids[1]: Decimal("33.33"), ids[2]: Decimal("33.33")})
+        self.assertEqual(sum(split.values()), Decimal("100.00"))
+
+    def test_proportional_split_adds_up(self):
+        ids = [s.id for s in self.students]
+        split = split_amount(Decimal("10.00"), 'proportional', ids, {ids[0]: 1, ids[1]: 1, ids[2]: 1.5})
+        self.assertEqual(split, {ids[0]: Decimal("2.86"), ids[1]: Decimal("2.86"), ids[2]: Decimal("4.28")})
+
+    def test_expense_create_computes_split_and_settlements(self):
+        payload = {
+            'group_id': self.group.id, 'payer_id': self.students[0].id, 'amount': '90.00',
+            'category': 'Travel', 'split_type': 'equal',
+        }
+        response = self.client.post('/api/expenses/', payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        expense = Expense.objects.get()
+        self.assertEqual(expense.members_split, {str(s.id): "30.00" for s in self.students})
+        self.assertEqual(Settlement.objects.filter(expense=expense).count(), 2)
+
+    def test_update_recomputes_split_and_settlements(self):
+        payload = {
+            'group_id': self.group.id, 'payer_id': self.students[0].id, 'amount': '90.00',
+            'category': 'Travel', 'split_type': 'equal',
+        }
+        expense_id = self.client.post('/api/expenses/', payload, format='json').data['id']
+        url = f'/api/expenses/{expense_id}/'
+
+        response = self.client.patch(url, {'amount': '50.00', 'split_type': 'proportional'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)  # No weights to split by
+
+        response = self.client.patch(url, {'amount': '60.00'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Expense.objects.get().members_split, {str(s.id): "20.00" for s in self.students})
+        amounts = Settlement.objects.filter(expense_id=expense_id).values_list('amount', flat=True)
+        self.assertEqual(sorted(amounts), [Decimal("20.00"), Decimal("20.00")])
+
+        Settlement.objects.filter(expense_id=expense_id, receiver=self.students[1]).update(payment_status=True)
+        response = self.client.patch(url, {'amount': '30.00'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Expense.objects.get().amount, Decimal("60.00"))
+
+    def test_bulk_import_and_invalid_explicit_split(self):
+        payload = [
+            {'group_id': self.group.id, 'payer_id': self.students[1].id, 'amount': '10.00',
+             'category': 'Travel', 'split_type': 'equal'},
+            {'group_id': self.group.id, 'payer_id': self.students[1].id, 'amount': '10.00',
+             'category': 'Travel', 'split_type': 'proportional', 'weights': {str(self.students[0].id): 1}},
+        ]
+        response = self.client.post('/api/expenses/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Expense.objects.count(), 2)
+        self.assertEqual(Settlement.objects.count(), 3)
+
+        payload = payload[0] | {'members_split': {str(self.students[0].id): 5}}
+        response = self.client.post('/api/expenses/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        shares = dict(zip((str(s.id) for s in self.students), ('3.333', '3.333', '3.334')))
+        response = self.client.post('/api/expenses/', payload | {'members_split': shares}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('two decimal places', str(response.data['members_split']))
+        self.assertEqual(Expense.objects.count(), 2)
+
+    def test_malformed_splits_rejected_without_side_effects(self):
+        base = {'group_id': self.group.id, 'payer_id': self.students[0].id, 'amount': '10.00',
+                'category': 'Travel', 'split_type': 'proportional'}
+        outsider = Student.objects.create_user(username="outsider", semester=1)
+        for extra in [{'members_split': {'abc': '10.00'}}, {'members_split': {str(self.students[1].id): 'NaN'}},
+                      {'members_split': {str(outsider.id): '10.00'}}, {'weights': {'abc': 1}}, {'weights': [1, 2]}]:
+            throttling.store.local.clear()  # Bulk imports are costly for the route throttle
+            response = self.client.post('/api/expenses/bulk/', [base | {'split_type': 'equal'}, base | extra],
+                                        format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, extra)
+            response = self.client.post('/api/expenses/', base | extra, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, extra)
+        self.assertFalse(Expense.objects.exists())
+
+class SettlementReminderTestCase(APITestCase):
+    def setUp(self):
+        self.payer = Student.objects.create_user(username="payer", email="payer@example.com", semester=1)
+        self.receiver = Student.objects.create_user(username="receiver", email="receiver@example.com", semester=1)
+        self.pending = Settlement.objects.create(
+            payer=self.payer, receiver=self.receiver, amount=Decimal("10.00"), settlement_method='upi'
+        )
+        self.settled = Settlement.objects.create(
+            payer=self.payer, receiver=self.receiver, amount=Decimal("5.00"), settlement_method='upi',
+            payment_status=True,
+        )
+
+    def test_admin_action_queues_pending_reminders(self):
+        admin_user = User.objects.create_superuser(username="admin", password="password123")
+        self.client.force_login(admin_user)
+        for _ in range(2):
+            self.client.post('/admin/core/settlement/', {
+                'action': 'send_reminder', '_selected_action': [self.pending.pk, self.settled.pk],
+            })
+        self.assertEqual(list(ReminderJob.objects.values_list('settlement_id', 'status')), [(self.pending.pk, 'pending')])
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.client.force_login(User.objects.create_superuser(username="admin", password="password123"))
+        group = Group.objects.create(name="Flat", group_type="friends")
+        category = Category.objects.create(name="Food")
+
+        def add_rows(count):
+            for _ in range(count):
+                Expense.objects.create(amount=Decimal("10.00"), category=category, split_type='equal', group=group,
+                                       payer=self.payer)
+                Settlement.objects.create(group=group, payer=self.payer, receiver=self.receiver,
+                                          amount=Decimal("5.00"), settlement_method='upi')
+
+        for url in ['/admin/core/expense/', '/admin/core/settlement/']:
+            add_rows(2)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+            add_rows(20)
+            with self.assertNumQueries(len(queries)):
+                self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+    def test_estimated_count_paginator(self):
+        self.assertEqual(EstimatedCountPaginator(Settlement.objects.all(), 10).count, 2)  # COUNT(*) off PostgreSQL
+
+        postgres = mock.MagicMock(vendor='postgresql')
+        postgres.cursor.return_value.__enter__.return_value.fetchone.return_value = (250000.0,)
+        with mock.patch('core.admin.connections', {'default': postgres}):
+            self.assertEqual(EstimatedCountPaginator(Settlement.objects.all(), 10).count, 250000)
+            # Filtered changelists and small tables still count exactly
+            self.assertEqual(EstimatedCountPaginator(Settlement.objects.filter(payment_status=True), 10).count, 1)
+            postgres.cursor.return_value.__enter__.return_value.fetchone.return_value = (50.0,)
+            self.assertEqual(EstimatedCountPaginator(Settlement.objects.all(), 10).count, 2)
+
+    def test_worker_sends_and_cancels_settled(self):
+        queue_reminders([self.pending.pk, self.settled.pk])
+        call_command('process_reminders', stdout=StringIO())
+        self.assertEqual(mail.outbox[0].to, ["receiver@example.com"])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(dict(ReminderJob.objects.values_list('settlement_id', 'status')),
+                         {self.pending.pk: 'sent', self.settled.pk: 'cancelled'})
+
+    @override_settings(REMINDER_MAX_ATTEMPTS=2)
+    def test_failed_send_is_retried_then_given_up(self):
+        queue_reminders([self.pending.pk])
+        with mock.patch('core.reminders.EmailMessage.send', side_effect=OSError("SMTP down")), \
+                self.assertLogs('core.reminders', 'WARNING'):
+            process_reminders(claim_reminders(10))
+            job = ReminderJob.objects.get()
+            self.assertEqual((job.status, job.attempts, job.error), ('pending', 1, "SMTP down"))
+            self.assertEqual(claim_reminders(10), [])  # Not due yet
+
+            ReminderJob.objects.update(run_after=timezone.now())
+            process_reminders(claim_reminders(10))
+        self.assertEqual(ReminderJob.objects.get().status, 'failed')
+
+    def test_expired_lease_is_reclaimed(self):
+        queue_reminders([self.pending.pk])
+        claim_reminders(10)
+        self.assertEqual(claim_reminders(10), [])
+        ReminderJob.objects.update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual([job.attempts for job in claim_reminders(10)], [2])
+
+class ArchiveTestCase(APITestCase):
+    def setUp(self):
+        self.payer = Student.objects.create_user(username="payer", semester=1)
+        self.receiver = Student.objects.create_user(username="receiver", semester=1)
+        self.group = Group.objects.create(name="Flat", group_type="friends")
+        self.group.members.add(self.payer, self.receiver)
+        self.category = Category.objects.create(name="Rent")
+        self.closed = self._expense(date(2023, 1, 10), paid=True)
+        self.open = self._expense(date(2023, 1, 11), paid=False)
+        self.recent = self._expense(date.today(), paid=True)
+        self.client.force_authenticate(self.payer)
+
+    def _expense(self, day, paid):
+        expense = Expense.objects.create(
+            amount=Decimal("20.00"), category=self.category, split_type='equal', group=self.group, payer=self.payer
+        )
+        Expense.objects.filter(pk=expense.pk).update(date=day)
+        Settlement.objects.create(
+            expense=expense, group=self.group, payer=self.payer, receiver=self.receiver,
+            amount=Decimal("10.00"), payment_status=paid, settlement_method='upi',
+        )
+        return expense
+
+    def test_archive_moves_only_closed_old_rows(self):
+        call_command('archive', before=date(2024, 1, 1), chunk_size=1, stdout=StringIO())
+        self.assertFalse(Tombstone.objects.exists())  # Archived rows are not deletions for sync clients
+
+        self.assertEqual(list(ArchivedExpense.objects.values_list('pk', flat=True)), [self.closed.pk])
+        self.assertEqual(ArchivedSettlement.objects.get().date, date(2023, 1, 10))
+        self.assertEqual(set(Expense.objects.values_list('pk', flat=True)), {self.open.pk, self.recent.pk})
+        self.assertEqual(Settlement.objects.count(), 2)
+
+    def test_include_archived_flag(self):
+        call_command('archive', before=date(2024, 1, 1), stdout=StringIO())
+
+        response = self.client.get('/api/expenses/')
+        self.assertEqual(response.json()['count'], 2)
+
+        response = self.client.get('/api/expenses/', {'include_archived': 'true'})
+        results = response.json()['results']
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[-1]['id'], self.closed.pk)
+        self.assertTrue(results[-1]['archived'])
+
+        response = self.client.get('/api/settlements/', {'include_archived': 'true', 'group': self.group.pk})
+        self.assertEqual(response.json()['count'], 3)
+
+    def test_analytics_include_archived(self):
+        call_command('archive', before=date(2024, 1, 1), stdout=StringIO())
+
+        response = self.client.get('/analysis/monthly/')
+        self.assertEqual(response.json()['results'], [{'category__name': 'Rent', 'total_amount': 40.0}])
+        response = self.client.get('/analysis/monthly/', {'include_archived': 'true'})
+        self.assertEqual(response.json()['results'], [{'category__name': 'Rent', 'total_amount': 60.0}])
+
+        params = {'start_month': '2023-01', 'end_month': '2023-01'}
+        response = self.client.get('/analysis/trends/', params)
+        self.assertEqual(response.json()['groups'][0]['totals'], [20.0])
+        response = self.client.get('/analysis/trends/', params | {'include_archived': 'true'})
+        self.assertEqual(response.json()['groups'][0]['totals'], [40.0])
+
+    def test_partition_requires_postgresql(self):
+        with self.assertRaisesMessage(CommandError, "only supported on PostgreSQL"):
+            call_command('archive', partition=True, stdout=StringIO())
+
+class GroupEventsTestCase(TestCase):
+    def setUp(self):
+        self.member = Student.objects.create_user(username="member", semester=1)
+        self.outsider = Student.objects.create_user(username="outsider", semester=1)
+        self.group = Group.objects.create(name="Flat", group_type="friends")
+        self.group.members.add(self.member)
+        self.category = Category.objects.create(name="Food")
+
+    def _token(self, student):
+        # Tokens are issued for the default user model and matched to students by username
+        user = User.objects.create_user(username=student.username)
+        return str(RefreshToken.for_user(user).access_token)
+
+    def test_events_published_on_commit(self):
+        with mock.patch('core.events.get_broker') as get_broker, self.captureOnCommitCallbacks(execute=True):
+            expense = Expense.objects.create(
+                amount=Decimal("10.00"), category=self.category, split_type='equal',
+                group=self.group, payer=self.member,
+            )
+            settlement = Settlement.objects.create(
+                expense=expense, group=self.group, payer=self.member, receiver=self.outsider,
+                amount=Decimal("5.00"), settlement_method='upi',
+            )
+            settlement.payment_status = True
+            settlement.save()
+            settlement.save()
+
+        events = [call.args for call in get_broker.return_value.publish.call_args_list]
+        self.assertEqual([event['type'] for _, event in events],
+                         ['expense.created', 'settlement.created', 'settlement.paid'])
+        self.assertEqual({channel for channel, _ in events}, {f"group:{self.group.pk}"})
+
+    async def test_stream_delivers_group_events(self):
+        token = await sync_to_async(self._token)(self.member)
+        response = await self.async_client.get(
+            f'/api/groups/{self.group.pk}/events/', headers={'authorization': f'Bearer {token}'}
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b"retry: 5000\n\n")
+
+        get_broker().publish(group_channel(self.group.pk), {'type': 'expense.created', 'data': {'id': 1}})
+        self.assertEqual(await anext(stream), b'event: expense.created\ndata: {"id": 1}\n\n')
+        await stream.aclose()
+
+    async def test_stream_requires_membership(self):
+        token = await sync_to_async(self._token)(self.outsider)
+        response = await self.async_client.get(f'/api/groups/{self.group.pk}/events/', {'token': token})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_stream_hides_group_pending_deletion(self):
+        token = await sync_to_async(self._token)(self.member)
+        await Group.objects.filter(pk=self.group.pk).aupdate(deletion_requested_at=timezone.now())
+        response = await self.async_client.get(f'/api/groups/{self.group.pk}/events/', {'token': token})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class SchemaTestCase(APITestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'openapi.json'
+        patcher = mock.patch('pocketsense.schema._schema', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_schema_generated_once_and_served_with_etag(self):
+        with self.settings(OPENAPI_SCHEMA_PATH=self.path):
+            call_command('generate_schema', stdout=StringIO())
+            self.assertTrue(schema_path().exists())
+            self.assertEqual(self.client.get('/docs/openapi.json').status_code, status.HTTP_401_UNAUTHORIZED)
+
+            self.client.force_authenticate(User.objects.create_user(username="reader"))
+            with mock.patch('pocketsense.schema.generate_schema') as generate:
+                response = self.client.get('/docs/openapi.json')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertIn('/api/expenses/', response.json()['paths'])
+                self.assertIn('max-age=3600', response['Cache-Control'])
+
+                response = self.client.get('/docs/openapi.json', headers={'if-none-match': response['ETag']})
+                self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            generate.assert_not_called()
+
+    def test_schema_regenerated_when_code_changes(self):
+        with self.settings(OPENAPI_SCHEMA_PATH=self.path):
+            call_command('generate_schema', stdout=StringIO())
+            old_path = schema_path()
+            with mock.patch('pocketsense.schema.code_version', return_value='changed'), \
+                    mock.patch('pocketsense.schema._schema', None):
+                load_schema()
+                self.assertTrue(schema_path().exists())
+            self.assertFalse(old_path.exists())
+
+    def test_schema_generation_skips_request_scoped_querysets(self):
+        with self.assertNoLogs('drf_yasg', level='WARNING'):
+            schema = json.loads(generate_schema())
+        self.assertIn('/api/statements/', schema['paths'])
+
+class ThrottleTestCase(APITestCase):
+    def setUp(self):
+        throttling.store.local.clear()
+        patcher = mock.patch.object(throttling.store, '_retry_at', 0)  # Forget earlier Redis failures
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.student = Student.objects.create_user(username="student1", semester=1)
+        self.client.force_authenticate(self.student)
+
+    def test_expensive_route_is_throttled_with_retry_after(self):
+        buckets = {'user': {'capacity': 100, 'refill_rate': 1}, 'route': {'capacity': 15, 'refill_rate': 1}}
+        with self.settings(THROTTLE_BUCKETS=buckets, THROTTLE_COSTS={'monthly-analysis': 10}):
+            response = self.client.get('/analysis/monthly/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['X-RateLimit-Remaining'], '5')
+
+            response = self.client.get('/analysis/monthly/')
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertIn(response['Retry-After'], ('5', '4'))
+
+            response = self.client.get('/api/categories/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['X-RateLimit-Limit'], '100')
+
+    def _redis_cache(self, client):
+        redis_cache = RedisCache('redis://localhost:6379/1', {})
+        redis_cache.__dict__['_cache'] = mock.Mock(**{'get_client.return_value': client})
+        return mock.patch.object(throttling, 'caches', {settings.THROTTLE_CACHE_ALIAS: redis_cache})
+
+    def test_redis_bucket_updated_in_one_call(self):
+        client = mock.Mock(**{'eval.return_value': [1, '41.5']})
+        with self._redis_cache(client), self.assertNumQueries(1):  # The view's own query
+            response = self.client.get('/api/categories/')
+        self.assertEqual(response['X-RateLimit-Remaining'], '41')
+        script, keys, key = client.eval.call_args.args[:3]
+        self.assertEqual((script, keys), (throttling.TAKE_SCRIPT, 1))
+        self.assertTrue(key.endswith(f"throttle:user:user:{self.student.pk}"))
+        self.assertEqual(client.eval.call_count, 1)
+
+    def test_unreachable_redis_falls_back_to_memory(self):
+        client = mock.Mock(**{'eval.side_effect': ConnectionError("refused")})
+        with self._redis_cache(client), self.assertLogs('core.throttling', 'WARNING'):
+            for remaining in ('299', '298'):
+                self.assertEqual(self.client.get('/api/categories/')['X-RateLimit-Remaining'], remaining)
+        self.assertEqual(client.eval.call_count, 1)  # Not retried until retry_seconds have passed
+
+    async def test_headers_middleware_runs_natively_under_asgi(self):
+        async def view(request):
+            request.throttle_remaining = (3, 10)
+            return HttpResponse()
+
+        middleware = ThrottleHeadersMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = await middleware(RequestFactory().get('/'))
+        self.assertEqual((response['X-RateLimit-Remaining'], response['X-RateLimit-Limit']), ('3', '10'))
+
+@override_settings(SYNC_SAFETY_WINDOW_SECONDS=0)
+class SyncTestCase(APITestCase):
+    def setUp(self):
+        self.student = Student.objects.create_user(username="student1", semester=1)
+        self.other = Student.objects.create_user(username="student2", semester=1)
+        self.group = Group.objects.create(name="Flat", group_type="friends")
+        self.group.members.add(self.student, self.other)
+        self.hidden = Group.objects.create(name="Other", group_type="study")
+        self.category = Category.objects.create(name="Food")
+        self.client.force_authenticate(self.student)
+
+    def _expense(self, group):
+        return Expense.objects.create(
+            amount=Decimal("10.00"), category=self.category, split_type='equal', group=group, payer=self.other
+        )
+
+    def _sync(self, since=None):
+        response = self.client.get('/api/sync/', {'since': since} if since else {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_returns_only_changes_since_token(self):
+        expense = self._expense(self.group)
+        self._expense(self.hidden)
+
+        data = self._sync()
+        self.assertEqual([g['id'] for g in data['groups']], [self.group.id])
+        self.assertEqual([e['id'] for e in data['expenses']], [expense.id])
+        self.assertFalse(data['has_more'])
+
+        data = self._sync(data['next'])
+        self.assertEqual((data['groups'], data['expenses'], data['deleted']), ([], [], []))
+
+        expense_id = expense.id
+        expense.delete()
+        data = self._sync(data['next'])
+        self.assertEqual(data['deleted'], [{'model': 'expense', 'id': expense_id}])
+
+        self.group.members.remove(self.student)
+        data = self._sync(data['next'])
+        self.assertEqual(data['deleted'], [{'model': 'group', 'id': self.group.id}])
+
+    def test_pages_with_cursor(self):
+        expenses = [self._expense(self.group) for _ in range(3)]
+        seen = []
+        token = None
+        with self.settings(SYNC_PAGE_SIZE=2):
+            while True:
+                data = self._sync(token)
+                seen += [e['id'] for e in data['expenses']]
+                token = data['next']
+                if not data['has_more']:
+                    break
+        self.assertEqual(seen, [e.id for e in expenses])
+
+    def test_joined_group_history_is_sent(self):
+        self._expense(self.group)
+        history = [self._expense(self.hidden) for _ in range(3)]
+        token = self._sync()['next']
+
+        self.hidden.members.add(self.student)
+        seen = []
+        with self.settings(SYNC_PAGE_SIZE=2):
+            while True:
+                data = self._sync(token)
+                seen += [e['id'] for e in data['expenses']]
+                token = data['next']
+                if not data['has_more']:
+                    break
+        self.assertEqual(seen, [e.id for e in history])
+        self.assertEqual(self._sync(token)['expenses'], [])
+
+    def test_old_records_pruned_and_old_tokens_expire(self):
+        expense = self._expense(self.group)
+        token = self._sync()['next']
+        expense.delete()
+        Tombstone.objects.update(deleted_at=timezone.now() - timedelta(days=91))
+
+        call_command('prune_sync', stdout=StringIO())
+        self.assertFalse(Tombstone.objects.exists())
+        with mock.patch('core.sync.timezone.now', return_value=timezone.now() + timedelta(days=91)):
+            response = self.client.get('/api/sync/', {'since': token})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+    def test_invalid_token(self):
+        response = self.client.get('/api/sync/', {'since': 'not-a-token'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StatementJobTestCase(APITestCase):
+    def setUp(self):
+        self.student = Student.objects.create_user(username="student1", semester=1)
+        self.other = Student.objects.create_user(username="student2", semester=1)
+        self.group = Group.objects.create(name="Flat", group_type="friends")
+        self.group.members.add(self.student, self.other)
+        category = Category.objects.create(name="Food")
+        expense = Expense.objects.create(
+            amount=Decimal("12.50"), category=category, split_type='equal', group=self.group, payer=self.student
+        )
+        Expense.objects.filter(pk=expense.pk).update(date=date(2024, 3, 10))
+        self.client.force_authenticate(self.student)
+        self.statement_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.statement_dir.cleanup)
+
+    def _request(self, **data):
+        payload = {'subject_type': 'group', 'subject_id': self.group.id, 'month': '2024-03-15', 'file_format': 'csv'}
+        return self.client.post('/api/statements/', {**payload, **data})
+
+    def test_statement_rendered_and_reused(self):
+        with override_settings(STATEMENT_DIR=Path(self.statement_dir.name)):
+            response = self._request()
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual((response.data['status'], response.data['month']), ('pending', '2024-03-01'))
+
+            call_command('process_statements', '--workers', '1', stdout=StringIO())
+            download = self.client.get(f"/api/statements/{response.data['id']}/download/")
+            self.assertEqual(download.status_code, status.HTTP_200_OK)
+            content = b''.join(download.streaming_content).decode()
+            self.assertIn('expense,2024-03-10,Flat,Food,student1,,12.50,', content)
+
+            repeat = self._request()
+            self.assertEqual(repeat.data['status'], 'done')
+
+    @override_settings(STATEMENT_LEASE_SECONDS=60, STATEMENT_MAX_ATTEMPTS=2)
+    def test_stale_running_jobs_reclaimed_then_failed(self):
+        job_id = self._request().data['id']
+        self.assertEqual([job.pk for job in claim_jobs(10)], [job_id])
+        self.assertEqual(claim_jobs(10), [])  # Still leased
+
+        stale = timezone.now() - timedelta(minutes=5)
+        StatementJob.objects.update(started_at=stale)
+        self.assertEqual([job.attempts for job in claim_jobs(10)], [2])
+        StatementJob.objects.update(started_at=stale)
+        self.assertEqual(claim_jobs(10), [])
+        job = StatementJob.objects.get()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+
+    def test_other_subjects_rejected(self):
+        outsider = Group.objects.create(name="Other", group_type="study")
+        self.assertEqual(self._request(subject_id=outsider.id).status_code, status.HTTP_403_FORBIDDEN)
+        response = self._request(subject_type='student', subject_id=self.other.id)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class DeferredDeletionTestCase(APITestCase):
+    def setUp(self):
+        self.student = Student.objects.create_user(username="student1", semester=1)
+        self.other = Student.objects.create_user(username="student2", semester=1)
+        self.group = Group.objects.create(name="Flat", group_type="friends")
+        self.group.members.add(self.student, self.other)
+        category = Category.objects.create(name="Food")
+        for _ in range(5):
+            expense = Expense.objects.create(
+                amount=Decimal("10.00"), category=category, split_type='equal', group=self.group, payer=self.student
+            )
+            Settlement.objects.create(
+                expense=expense, group=self.group, payer=self.student, receiver=self.other,
+                amount=Decimal("5.00"), settlement_method='cash'
+            )
+        StatementJob.objects.create(
+            subject_type='group', subject_id=self.group.id, month=date(2024, 3, 1), file_format='csv',
+            requested_by=self.student
+        )
+        self.client.force_authenticate(self.student)
+
+    def test_group_hidden_then_purged_in_batches(self):
+        response = self.client.delete(f'/api/groups/{self.group.id}/')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(Group.objects.filter(pk=self.group.id).exists())
+        self.assertEqual(self.client.get(f'/api/groups/{self.group.id}/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/expenses/').data['count'], 0)
+        response = self.client.post('/api/statements/', {
+            'subject_type': 'group', 'subject_id': self.group.id, 'month': '2024-03-01', 'file_format': 'csv',
+        })
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        out = StringIO()
+        call_command('purge_deleted', '--batch-size', '2', stdout=out)
+        self.assertIn(f"group {self.group.id}: deleted 5 expenses", out.getvalue())
+        self.assertFalse(Group.objects.filter(pk=self.group.id).exists())
+        self.assertFalse(Expense.objects.exists())
+        self.assertFalse(Settlement.objects.exists())
+        self.assertFalse(StatementJob.objects.exists())
+        self.assertEqual(Student.objects.count(), 2)
+
+    def test_student_deactivated_then_purged(self):
+        response = self.client.delete(f'/api/students/{self.other.id}/')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.other.refresh_from_db()
+        self.assertFalse(self.other.is_active)
+        self.assertEqual([s['id'] for s in self.client.get('/api/students/').data['results']], [self.student.id])
+        self.assertEqual(self.client.get(f'/api/groups/{self.group.id}/').data['members'], [self.student.id])
+        self.assertEqual(self.client.get('/api/settlements/').data['count'], 0)  # Owed by the pending student
+        expenses = self.client.get('/api/expenses/').data['results']
+        self.assertEqual(len(expenses), 5)
+        self.assertEqual(expenses[0]['group']['members'], [self.student.id])
+
+        call_command('purge_deleted', stdout=StringIO())
+        self.assertFalse(Student.objects.filter(pk=self.other.id).exists())
+        self.assertFalse(Settlement.objects.exists())
+        self.assertEqual(Expense.objects.count(), 5)
+        self.assertEqual(list(self.group.members.all()), [self.student])
+
+
+class ProfilingTestCase(APITestCase):
+    def setUp(self):
+        self.student = Student.objects.create_user(username="student1", semester=1)
+        self.other = Student.objects.create_user(username="student2", semester=1)
+        group = Group.objects.create(name="Flat", group_type="friends")
+        Settlement.objects.create(
+            group=group, payer=self.student, receiver=self.other, amount=Decimal("5.00"), settlement_method='cash'
+        )
+        self.client.force_authenticate(self.student)
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profile_dir.cleanup)
+
+    def test_signed_header_profiles_request(self):
+        with override_settings(PROFILING_DIR=Path(self.profile_dir.name), PROFILING_MAX_ENTRIES=2):
+            self.assertNotIn('X-Profile-Id', self.client.get('/api/settlements/'))
+            self.assertNotIn('X-Profile-Id', self.client.get('/api/settlements/', HTTP_X_PROFILE='forged'))
+
+            for _ in range(3):
+                response = self.client.get('/api/settlements/', {'status': 'False', 'token': 'secret'},
+                                           HTTP_X_PROFILE=make_token())
+            profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+
+        self.assertEqual(RequestProfile.objects.count(), 2)
+        self.assertEqual(len(list(Path(self.profile_dir.name).iterdir())), 2)
+        self.assertEqual((profile.path, profile.query_string, profile.status_code),
+                         ('/api/settlements/', 'status=[redacted]&token=[redacted]', 200))
+        self.assertGreater(profile.sql_count, 0)
+        params = [param for query in profile.report['slow_queries'] for param in query['params'] or []]
+        self.assertTrue(params)
+        self.assertTrue(all(param.startswith('<') for param in params))
+        self.assertTrue(any('explain' in query for query in profile.report['slow_queries']))
+        self.assertTrue(profile.report['serializers'])
+
+        admin_user = User.objects.create_superuser(username="admin", password="password123")
+        self.client.force_login(admin_user)
+        page = self.client.get(f'/admin/core/requestprofile/{profile.pk}/change/')
+        self.assertContains(page, 'cumulative')
+
+
+class AsyncProfilingTestCase(TransactionTestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profile_dir.cleanup)
+
+    async def test_asgi_request_profiled_without_adapting_chain(self):
+        async def view(request):
+            return HttpResponse()
+        self.assertTrue(iscoroutinefunction(ProfilingMiddleware(view)))
+
+        student = await sync_to_async(Student.objects.create_user)(username="student1", semester=1)
+        user = await sync_to_async(User.objects.create_user)(username=student.username)
+        token = str(RefreshToken.for_user(user).access_token)
+        with override_settings(PROFILING_DIR=Path(self.profile_dir.name)):
+            response = await self.async_client.get(
+                '/api/students/', headers={'authorization': f'Bearer {token}', 'x-profile': make_token()}
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile = await RequestProfile.objects.aget(pk=response['X-Profile-Id'])
+        self.assertGreater(profile.sql_count, 0)
+
+
+class MembershipScopeTestCase(APITestCase):
+    def setUp(self):
+        self.student = Student.objects.create_user(username="student1", semester=1)
+        self.friend = Student.objects.create_user(username="student2", semester=1)
+        self.stranger = Student.objects.create_user(username="student3", semester=1)
+        self.group = Group.objects.create(name="Flat", group_type="friends")
+        self.group.members.add(self.student, self.friend)
+        self.other_group = Group.objects.create(name="Team", group_type="sports")
+        self.other_group.members.add(self.friend, self.stranger)
+        category = Category.objects.create(name="Food")
+        for group, payer, receiver in [(self.group, self.student, self.friend),
+                                       (self.other_group, self.stranger, self.friend),
+                                       (self.other_group, self.friend, self.stranger)]:
+            expense = Expense.objects.create(
+                amount=Decimal("10.00"), category=category, split_type='equal', group=group, payer=payer
+            )
+            Settlement.objects.create(
+                expense=expense, group=group, payer=payer, receiver=receiver,
+                amount=Decimal("5.00"), settlement_method='cash'
+            )
+        self.client.force_authenticate(self.student)
+
+    def _plan(self, queryset):
+        if connection.vendor == 'postgresql':
+            # Tiny test tables would always be scanned sequentially
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def test_lists_scoped_to_memberships(self):
+        counts = {
+            path: self.client.get(f'/api/{path}/').json()['count']
+            for path in ['students', 'groups', 'expenses', 'settlements']
+        }
+        self.assertEqual(counts, {'students': 2, 'groups': 1, 'expenses': 1, 'settlements': 1})
+        self.assertEqual(Expense.objects.count(), 3)
+        response = self.client.get(f'/api/groups/{self.other_group.id}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_scoped_queries_use_indexes(self):
+        group_ids = member_group_ids(self.student)
+        self.assertIn('core_group_members_student_group_idx', self._plan(Group.objects.filter(pk__in=group_ids)))
+        expenses = Expense.objects.filter(group_id__in=group_ids, date__range=[date(2024, 1, 1), date(2024, 12, 31)])
+        self.assertIn('core_expense_group_date_idx', self._plan(expenses))
+        settlements = Settlement.objects.filter(group_id__in=group_ids, payment_status=False)
+        self.assertIn('core_settle_group_status_idx', self._plan(settlements))
+
+    def test_writes_scoped_to_memberships(self):
+        base = {'group_id': self.group.id, 'payer_id': self.student.id, 'amount': '10.00',
+                'category': 'Food', 'split_type': 'equal'}
+        for payload in [base | {'group_id': self.other_group.id}, base | {'payer_id': self.stranger.id}]:
+            self.assertEqual(self.client.post('/api/expenses/', payload, format='json').status_code,
+                             status.HTTP_400_BAD_REQUEST)
+            response = self.client.post('/api/expenses/bulk/', [base, payload], format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Expense.objects.count(), 3)
+
+        # Any active student can be added to a group, including one the requester shares no group with yet
+        pending = Student.objects.create_user(username="student4", semester=1, deletion_requested_at=timezone.now())
+        payload = {'name': 'New', 'group_type': 'study', 'members': [self.student.id, pending.id]}
+        self.assertEqual(self.client.post('/api/groups/', payload, format='json').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        payload['members'] = [self.student.id, self.stranger.id]
+        self.assertEqual(self.client.post('/api/groups/', payload, format='json').status_code,
+                         status.HTTP_201_CREATED)
@@ -0,0 +1,157 @@
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+
+# KEYS[1]: bucket. ARGV: capacity, refill rate, cost, now, expiry in seconds.
+# Returns {allowed (0/1), tokens left}; floats go back as strings since Redis truncates Lua numbers
+TAKE_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local capacity, rate, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return {allowed, tostring(tokens)}
+"""
+
+
+def refill(state, capacity, rate, cost, now):
+    """
+    Refill a (tokens, updated) bucket up to `now` and take `cost` tokens if there are
+    enough. Returns (tokens left, allowed).
+    """
+    tokens, updated = state or (capacity, now)
+    tokens = min(capacity, tokens + max(now - updated, 0) * rate)
+    if tokens >= cost:
+        return tokens - cost, True
+    return tokens, False
+
+
+class BucketStore:
+    """
+    Bucket state in the Redis cache named by THROTTLE_CACHE_ALIAS. Each request
+    updates its bucket with a single Lua script call, so concurrent requests cannot
+    spend the same tokens twice and a check costs one round trip.
+
+    With any other cache backend, or while Redis is unreachable, buckets are kept in
+    a bounded in-process LocMemCache instead and Redis is tried again after
+    `retry_seconds`.
+    """
+    retry_seconds = 30
+    local_max_keys = 10000
+
+    def __init__(self):
+        self.local = LocMemCache('core.throttling', {'OPTIONS': {'MAX_ENTRIES': self.local_max_keys}})
+        self._lock = threading.Lock()
+        self._retry_at = 0
+
+    def take(self, key, capacity, rate, cost, now, timeout):
+        """
+        Refill the bucket under `key` and take `cost` tokens from it if there are
+        enough. Returns (tokens left, allowed).
+        """
+        cache = caches[settings.THROTTLE_CACHE_ALIAS]
+        if isinstance(cache, RedisCache) and time.monotonic() >= self._retry_at:
+            try:
+                client = cache._cache.get_client(key, write=True)
+                allowed, tokens = client.eval(
+                    TAKE_SCRIPT, 1, cache.make_and_validate_key(key), capacity, rate, cost, now, timeout
+                )
+                return float(tokens), bool(allowed)
+            except Exception:
+                logger.warning("Throttle cache unavailable, using in-memory buckets.", exc_info=True)
+                self._retry_at = time.monotonic() + self.retry_seconds
+        return self.take_local(key, capacity, rate, cost, now, timeout)
+
+    def take_local(self, key, capacity, rate, cost, now, timeout):
+        with self._lock:
+            tokens, allowed = refill(self.local.get(key), capacity, rate, cost, now)
+            self.local.set(key, (tokens, now), timeout)
+        return tokens, allowed
+
+
+store = BucketStore()
+
+
+def route_name(request):
+    match = request.resolver_match
+    return match.url_name if match else None
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token bucket throttle. Every request takes its route's cost in tokens
+    (THROTTLE_COSTS, default 1) and buckets refill continuously up to their capacity
+    (THROTTLE_BUCKETS[scope]). The tightest remaining budget is exposed to
+    ThrottleHeadersMiddleware.
+    """
+    scope = None
+
+    def get_bucket_key(self, request, view):
+        raise NotImplementedError('.get_bucket_key() must be overridden')
+
+    def get_ident_key(self, request):
+        if request.user and request.user.is_authenticated:
+            return f"user:{request.user.pk}"
+        return f"anon:{self.get_ident(request)}"
+
+    def allow_request(self, request, view):
+        key = self.get_bucket_key(request, view)
+        if key is None:
+            return True
+
+        bucket = settings.THROTTLE_BUCKETS[self.scope]
+        capacity, rate = bucket['capacity'], bucket['refill_rate']
+        cost = min(settings.THROTTLE_COSTS.get(route_name(request), 1), capacity)
+
+        tokens, allowed = store.take(key, capacity, rate, cost, time.time(), math.ceil(capacity / rate) + 1)
+        self.wait_seconds = None if allowed else (cost - tokens) / rate
+
+        http_request = request._request
+        remaining = getattr(http_request, 'throttle_remaining', None)
+        if remaining is None or tokens < remaining[0]:
+            http_request.throttle_remaining = (int(tokens), capacity)
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class UserCostThrottle(TokenBucketThrottle):
+    """
+    One bucket per user (or client IP) shared by every endpoint.
+    """
+    scope = 'user'
+
+    def get_bucket_key(self, request, view):
+        return f"throttle:{self.scope}:{self.get_ident_key(request)}"
+
+
+class RouteCostThrottle(TokenBucketThrottle):
+    """
+    A separate bucket per user for each route with a configured cost, so one
+    expensive endpoint cannot use up a client's whole budget.
+    """
+    scope = 'route'
+
+    def get_bucket_key(self, request, view):
+        name = route_name(request)
+        if name not in settings.THROTTLE_COSTS:
+            return None
+        return f"throttle:{self.scope}:{self.get_ident_key(request)}:{name}"
@@ -1,34 +1,126 @@
-from django.db.models import Sum
-from rest_framework import viewsets, status, filters
+import asyncio
+import json
+import math
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, JsonResponse, StreamingHttpResponse
+from django.db.models import Q, Sum
+from rest_framework import viewsets, mixins, status, filters
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.pagination import PageNumberPagination
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from django.core.mail import send_mail
 from django.conf import settings
-from .models import Expense, Student, Group, Settlement, Category
+from .models import Expense, Student, Group, Settlement, Category, ArchivedExpense, ArchivedSettlement, StatementJob
+from .archive import ArchiveChain
+from .auth import get_student, member_group_ids, visible_students, without_pending_students
+from .events import get_broker, group_channel
+from .deletion import request_deletion
+from .statements import use_cached_file
+from .sync import InvalidSyncToken, SyncTokenExpired, changes_since
+from .reminders import reminder_message
 from .serializers import (
     ExpenseSerializer,
     StudentSerializer,
     GroupSerializer,
     SettlementSerializer,
     CategorySerializer,
+    ArchivedExpenseSerializer,
+    ArchivedSettlementSerializer,
+    StatementJobSerializer,
 )
 
-class StudentViewSet(viewsets.ModelViewSet):
+
+def wants_archived(request):
+    return request.query_params.get('include_archived', '').lower() in ('1', 'true', 'yes')
+
+
+class IncludeArchivedMixin:
+    """
+    Appends archived rows to list responses when called with ?include_archived=true.
+    """
+    archived_queryset = None
+    archived_serializer_class = None
+
+    def get_archived_queryset(self):
+        return self.archived_queryset.all()
+
+    def list(self, request, *args, **kwargs):
+        if not wants_archived(request):
+            return super().list(request, *args, **kwargs)
+
+        queryset = ArchiveChain(
+            self.filter_queryset(self.get_queryset()),
+            self.filter_queryset(self.get_archived_queryset()),
+        )
+        page = self.paginate_queryset(queryset)
+        objects = page if page is not None else list(queryset)
+        data = [
+            (self.archived_serializer_class if isinstance(obj, self.archived_queryset.model) else self.get_serializer_class())(
+                obj, context=self.get_serializer_context()
+            ).data
+            for obj in objects
+        ]
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+class MembershipScopedMixin:
+    """
+    Limit a viewset to what the requesting student can see through their group
+    memberships. `scope_queryset` filters on a subquery of the membership table.
+    """
+    membership_field = 'group_id'
+
+    def scope_queryset(self, queryset, student):
+        return queryset.filter(**{f'{self.membership_field}__in': member_group_ids(student)})
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):  # Schema generation has no request user
+            return super().get_queryset().none()
+        return self.scope_queryset(super().get_queryset(), get_student(self.request.user))
+
+    def get_archived_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return super().get_archived_queryset().none()
+        return self.scope_queryset(super().get_archived_queryset(), get_student(self.request.user))
+
+class DeferredDeleteMixin:
+    """
+    Deletes only mark the object as pending deletion. It is hidden at once and
+    purged with its data by `manage.py purge_deleted`.
+    """
+
+    def destroy(self, request, *args, **kwargs):
+        request_deletion(self.get_object())
+        return Response({"message": "Scheduled for deletion."}, status=status.HTTP_202_ACCEPTED)
+
+class StudentViewSet(MembershipScopedMixin, DeferredDeleteMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing students.
     """
-    queryset = Student.objects.all()
+    queryset = Student.objects.filter(deletion_requested_at__isnull=True)
     serializer_class = StudentSerializer
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['username', 'email', 'college']
     ordering_fields = ['username', 'college', 'semester']
 
-class GroupViewSet(viewsets.ModelViewSet):
+    def scope_queryset(self, queryset, student):
+        return queryset.filter(visible_students(student))
+
+class GroupViewSet(MembershipScopedMixin, DeferredDeleteMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing groups.
     """
     queryset = Group.objects.all()
+    membership_field = 'pk'
     serializer_class = GroupSerializer
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'group_type']
@@ -40,20 +132,25 @@ class GroupViewSet(viewsets.ModelViewSet):
         Get all expenses for a group.
         """
         group = self.get_object()
-        expenses = Expense.objects.filter(group=group)
+        expenses = Expense.objects.filter(without_pending_students('payer'), group=group)
         serializer = ExpenseSerializer(expenses, many=True)
         return Response(serializer.data)
 
-class ExpenseViewSet(viewsets.ModelViewSet):
+class ExpenseViewSet(MembershipScopedMixin, IncludeArchivedMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing expenses.
     """
     queryset = Expense.objects.all()
     serializer_class = ExpenseSerializer
+    archived_queryset = ArchivedExpense.objects.select_related('group', 'payer', 'category')
+    archived_serializer_class = ArchivedExpenseSerializer
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['category__name', 'payer__username']
     ordering_fields = ['date', 'amount']
 
+    def scope_queryset(self, queryset, student):
+        return super().scope_queryset(queryset, student).filter(without_pending_students('payer'))
+
     def create(self, request, *args, **kwargs):
         """
         Custom logic for expense creation with settlements.
@@ -64,25 +161,55 @@ class ExpenseViewSet(viewsets.ModelViewSet):
 
         headers = self.get_success_headers(serializer.data)
 
-        # After creating an expense, you may want to handle splitting or settlement creation
-        # Here you can add custom logic to calculate the split and generate settlements
+        # Splitting and settlement creation happen in ExpenseSerializer
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
-class SettlementViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Import many expenses at once. Splits and settlements are computed in batches.
+        """
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+class SettlementViewSet(MembershipScopedMixin, IncludeArchivedMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing settlements.
     """
     queryset = Settlement.objects.all()
     serializer_class = SettlementSerializer
+    archived_queryset = ArchivedSettlement.objects.select_related(
+        'group', 'payer', 'receiver', 'expense__group', 'expense__payer', 'expense__category'
+    )
+    archived_serializer_class = ArchivedSettlementSerializer
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['payer__username', 'payee__username', 'payment_status']
     ordering_fields = ['due_date', 'amount']
 
+    def scope_queryset(self, queryset, student):
+        """
+        Settlements in the student's groups, plus ungrouped ones they take part in.
+        """
+        return queryset.filter(
+            Q(group_id__in=member_group_ids(student))
+            | Q(group__isnull=True, payer=student) | Q(group__isnull=True, receiver=student),
+            without_pending_students('payer', 'receiver', 'expense__payer'),
+        )
+
     def get_queryset(self):
         """
         Filter settlements based on query parameters.
         """
-        queryset = self.queryset
+        return self.filter_by_params(super().get_queryset())
+
+    def get_archived_queryset(self):
+        return self.filter_by_params(super().get_archived_queryset())
+
+    def filter_by_params(self, queryset):
+        if getattr(self, 'swagger_fake_view', False):
+            return queryset
         group_id = self.request.query_params.get('group')
         payer_id = self.request.query_params.get('payer')
         status_filter = self.request.query_params.get('status')
@@ -103,19 +230,12 @@ class SettlementViewSet(viewsets.ModelViewSet):
         """
         settlement = self.get_object()
         if not settlement.payment_status:  # Only send a reminder if payment is pending
-            subject = 'Payment Reminder from PocketSense'
-            message = f"""
-                    Hi {settlement.receiver.username},
-
-                    This is a reminder to settle the amount of ₹{settlement.amount} owed to {settlement.payer.username} for the expense in group "{settlement.group.name}".
-                    Please make the payment by {settlement.due_date} using your preferred payment method.
-                    """
-            recipient_list = [settlement.receiver.email]
+            subject, message, from_email, recipient_list = reminder_message(settlement)
             try:
                 send_mail(
                     subject,
                     message,
-                    settings.EMAIL_HOST_USER,
+                    from_email,
                     recipient_list,
                     fail_silently=False,
                 )
@@ -146,25 +266,31 @@ class MonthlyAnalysisViewSet(viewsets.ViewSet):
 
     def list(self, request):
         """
-        Return aggregated expenses grouped by category with optional filters.
+        Return aggregated expenses grouped by category with optional filters. Archived
+        expenses are counted too with ?include_archived=true.
         """
         category_name = request.query_params.get('category')
         start_date = request.query_params.get('start_date')
         end_date = request.query_params.get('end_date')
 
-        # Filter expenses based on the query parameters
-        expenses = Expense.objects.all()
+        # Filter the student's expenses based on the query parameters
+        scope = Q(group_id__in=member_group_ids(get_student(request.user))) & without_pending_students('payer')
         if category_name:
-            expenses = expenses.filter(category__name__icontains=category_name)
+            scope &= Q(category__name__icontains=category_name)
         if start_date and end_date:
-            expenses = expenses.filter(date__range=[start_date, end_date])
+            scope &= Q(date__range=[start_date, end_date])
 
-        # Aggregate data grouped by category
-        aggregated_data = (
-            expenses.values('category__name')
-            .annotate(total_amount=Sum('amount'))
-            .order_by('-total_amount')
-        )
+        # Aggregate data grouped by category, adding up live and archived totals
+        sources = [Expense, ArchivedExpense] if wants_archived(request) else [Expense]
+        totals = defaultdict(Decimal)
+        for model in sources:
+            rows = model.objects.filter(scope).values('category__name').annotate(total_amount=Sum('amount')).order_by()
+            for row in rows:
+                totals[row['category__name']] += row['total_amount']
+        aggregated_data = [
+            {'category__name': name, 'total_amount': total}
+            for name, total in sorted(totals.items(), key=lambda item: item[1], reverse=True)
+        ]
 
         # Paginate the data
         paginator = PageNumberPagination()
@@ -177,3 +303,184 @@ class MonthlyAnalysisViewSet(viewsets.ViewSet):
         # If no pagination is applied, return all data
         return Response(aggregated_data)
 
+
+class SpendingTrendsViewSet(viewsets.ViewSet):
+    """
+    API endpoint for spending trends and anomaly analytics.
+    """
+
+    def list(self, request):
+        """
+        Return month-by-month spending series per group, category and student,
+        rolling averages, per-group percentiles and anomalous expenses. Archived
+        expenses are included with ?include_archived=true.
+        """
+        from .analytics import month_index, parse_month, spending_trends  # Keep NumPy out of worker startup
+
+        today = date.today()
+        try:
+            group_id = int(request.query_params['group']) if request.query_params.get('group') else None
+            start_month = parse_month(request.query_params.get('start_month'))
+            end_month = parse_month(request.query_params.get('end_month'))
+            window = int(request.query_params.get('window', 3))
+            threshold = float(request.query_params.get('threshold', 3.5))
+            if end_month is None:
+                end_month = month_index(today.year, today.month)
+            if start_month is None:
+                start_month = end_month - 11
+            start = date(start_month // 12, start_month % 12 + 1, 1)
+            end = date((end_month + 1) // 12, (end_month + 1) % 12 + 1, 1)
+        except ValueError:
+            return Response({"error": "Invalid query parameters."}, status=status.HTTP_400_BAD_REQUEST)
+        if start_month > end_month or window < 1 or not math.isfinite(threshold):
+            return Response({"error": "Invalid month range, window or threshold."}, status=status.HTTP_400_BAD_REQUEST)
+        max_months = getattr(settings, 'ANALYTICS_MAX_MONTHS', 120)
+        if end_month - start_month + 1 > max_months:
+            return Response({"error": f"The month range can cover at most {max_months} months."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        student = get_student(request.user)
+        archived = wants_archived(request)
+        cache_key = (f"spending-trends:{student.pk if student else None}:{group_id or 'all'}:"
+                     f"{start_month}:{end_month}:{window}:{threshold}:{int(archived)}")
+        data = cache.get(cache_key)
+        if data is None:
+            scope = Q(group_id__in=member_group_ids(student), date__gte=start, date__lt=end)
+            scope &= without_pending_students('payer')
+            if group_id:
+                scope &= Q(group_id=group_id)
+            data = spending_trends(Expense.objects.filter(scope), start_month, end_month, window=window,
+                                   z_threshold=threshold,
+                                   archived=ArchivedExpense.objects.filter(scope) if archived else None)
+            cache.set(cache_key, data, getattr(settings, 'ANALYTICS_CACHE_TIMEOUT', 300))
+
+        return Response(data)
+
+
+class SyncViewSet(viewsets.ViewSet):
+    """
+    API endpoint for delta sync of the caller's groups, expenses and settlements.
+    """
+
+    def list(self, request):
+        """
+        Return what changed since the `since` token, plus deletions. Call again with
+        `next` while `has_more` is true, then keep the last `next` for the following
+        sync. Omitting `since` starts a full sync.
+        """
+        student = get_student(request.user)
+        if student is None:
+            return Response({"error": "No student profile for this user."}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            changes, next_token, has_more = changes_since(student, request.query_params.get('since'))
+        except SyncTokenExpired as e:
+            return Response({"error": str(e)}, status=status.HTTP_410_GONE)
+        except InvalidSyncToken as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        context = {'request': request}
+        return Response({
+            'groups': GroupSerializer(changes['groups'], many=True, context=context).data,
+            'expenses': ExpenseSerializer(changes['expenses'], many=True, context=context).data,
+            'settlements': SettlementSerializer(changes['settlements'], many=True, context=context).data,
+            'deleted': [{'model': tombstone.model, 'id': tombstone.object_id} for tombstone in changes['deleted']],
+            'next': next_token,
+            'has_more': has_more,
+        })
+
+class StatementJobViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin,
+                          viewsets.GenericViewSet):
+    """
+    API endpoint for requesting monthly statements and downloading them once rendered.
+    """
+    serializer_class = StatementJobSerializer
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):  # Schema generation has no request user
+            return StatementJob.objects.none()
+        return StatementJob.objects.filter(requested_by=get_student(self.request.user)).order_by('-created_at')
+
+    def perform_create(self, serializer):
+        student = get_student(self.request.user)
+        subject_type, subject_id = serializer.validated_data['subject_type'], serializer.validated_data['subject_id']
+        if student is None or (subject_type == 'student' and subject_id != student.pk) or (
+            subject_type == 'group'
+            and not Group.objects.filter(pk=subject_id, members=student, deletion_requested_at__isnull=True).exists()
+        ):
+            raise PermissionDenied("You can only request statements for yourself or your groups.")
+
+        job = StatementJob(requested_by=student, **serializer.validated_data)
+        use_cached_file(job)  # Repeat requests for unchanged data are served from disk
+        job.save()
+        serializer.instance = job
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """
+        Download a rendered statement.
+        """
+        job = self.get_object()
+        if job.status != 'done':
+            return Response({"error": f"Statement is {job.status}."}, status=status.HTTP_409_CONFLICT)
+        try:
+            handle = open(job.file_path, 'rb')
+        except FileNotFoundError:
+            # The cached file was removed; render it again
+            job.status = 'pending'
+            job.save(update_fields=['status'])
+            return Response({"error": "Statement is pending."}, status=status.HTTP_409_CONFLICT)
+        filename = f"statement-{job.subject_type}-{job.subject_id}-{job.month:%Y-%m}.{job.file_format}"
+        return FileResponse(handle, as_attachment=True, filename=filename)
+
+def _authenticate_stream(request):
+    """
+    Authenticate an event stream request from its Bearer header, or from a ?token=
+    query parameter since browser EventSource clients cannot set headers.
+    """
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header else request.GET.get('token')
+    if not raw_token:
+        return None
+    try:
+        return get_student(authentication.get_user(authentication.get_validated_token(raw_token)))
+    except (InvalidToken, TokenError):
+        return None
+
+
+async def group_events(request, pk):
+    """
+    Server-sent events stream of expense and settlement changes in a group.
+    Served through the ASGI application so idle connections don't hold a worker thread.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "Event streams are only served over ASGI."}, status=status.HTTP_501_NOT_IMPLEMENTED)
+
+    student = await sync_to_async(_authenticate_stream)(request)
+    if student is None:
+        return JsonResponse({"error": "Authentication credentials were not provided or are invalid."},
+                            status=status.HTTP_401_UNAUTHORIZED)
+    if not await Group.objects.filter(pk=pk, members=student, deletion_requested_at__isnull=True).aexists():
+        return JsonResponse({"error": "Group not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    response = StreamingHttpResponse(_event_stream(group_channel(pk)), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop reverse proxies from buffering the stream
+    return response
+
+
+async def _event_stream(channel):
+    broker = get_broker()
+    subscription = broker.subscribe(channel)
+    heartbeat = getattr(settings, 'EVENTS_HEARTBEAT_SECONDS', 15)
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                event = await subscription.get(timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+    finally:
+        broker.unsubscribe(subscription)
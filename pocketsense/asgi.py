@@ -2,6 +2,7 @@
 ASGI config for pocketsense project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Long-lived server-sent event streams (/api/groups/<id>/events/) are only served here.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -0,0 +1,144 @@
+"""
+OpenAPI schema for the PocketSense API.
+
+The schema is generated once per code version, by ``manage.py generate_schema``
+or on first use, and stored as a JSON artifact that is served to authenticated
+clients with ETag and Cache-Control headers. The artifact's file name carries a
+fingerprint of the modules that define the API, so a deploy that changes them
+regenerates the schema instead of serving the old one. drf_yasg is only imported
+when the schema or the Swagger UI is needed, so it stays out of the URLconf
+import on worker startup.
+"""
+import hashlib
+import importlib.util
+import threading
+from importlib.metadata import PackageNotFoundError, version as package_version
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from rest_framework.decorators import api_view
+
+SCHEMA_INFO = {
+    'title': "PocketSense API",
+    'default_version': 'v1',
+    'description': "API documentation for PocketSense",
+}
+
+_lock = threading.Lock()
+_schema = None
+_ui_view = None
+
+
+def generate_schema():
+    """
+    Introspect the API and return the schema as JSON bytes.
+    """
+    from drf_yasg import openapi
+    from drf_yasg.codecs import OpenAPICodecJson
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    generator = OpenAPISchemaGenerator(openapi.Info(**SCHEMA_INFO))
+    return OpenAPICodecJson(validators=[]).encode(generator.get_schema(request=None, public=True))
+
+
+def schema_version(content):
+    return f"{SCHEMA_INFO['default_version']}-{hashlib.sha256(content).hexdigest()[:16]}"
+
+
+def code_version():
+    """
+    Fingerprint of the modules listed in OPENAPI_SCHEMA_SOURCES and the installed
+    drf-yasg version, i.e. of everything the generated schema depends on.
+    """
+    digest = hashlib.sha256()
+    for module in settings.OPENAPI_SCHEMA_SOURCES:
+        digest.update(Path(importlib.util.find_spec(module).origin).read_bytes())
+    try:
+        digest.update(package_version('drf-yasg').encode())
+    except PackageNotFoundError:
+        pass
+    return digest.hexdigest()[:12]
+
+
+def schema_path():
+    """
+    The artifact path for the current code version, derived from OPENAPI_SCHEMA_PATH.
+    """
+    base = Path(settings.OPENAPI_SCHEMA_PATH)
+    return base.with_name(f"{base.stem}-{code_version()}{base.suffix}")
+
+
+def write_schema():
+    """
+    Generate the schema artifact for the current code version, remove artifacts of
+    other versions, and return the schema version.
+    """
+    global _schema
+    content = generate_schema()
+    path = schema_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    base = Path(settings.OPENAPI_SCHEMA_PATH)
+    for stale in path.parent.glob(f"{base.stem}-*{base.suffix}"):
+        if stale != path:
+            stale.unlink(missing_ok=True)
+    _schema = (content, schema_version(content))
+    return _schema[1]
+
+
+def load_schema():
+    """
+    Return (content, version) of the schema, reading the artifact for the current
+    code version or generating it on first use.
+    """
+    global _schema
+    if _schema is None:
+        with _lock:
+            if _schema is None:
+                path = schema_path()
+                if path.exists():
+                    content = path.read_bytes()
+                    _schema = (content, schema_version(content))
+                else:
+                    write_schema()
+    return _schema
+
+
+@api_view(['GET', 'HEAD'])
+@condition(etag_func=lambda request: load_schema()[1])
+def schema_json(request):
+    """
+    Serve the precomputed schema to authenticated clients, who revalidate with
+    If-None-Match.
+    """
+    content, version = load_schema()
+    response = HttpResponse(content, content_type='application/json')
+    response['X-Schema-Version'] = version
+    patch_cache_control(response, private=True, max_age=settings.OPENAPI_SCHEMA_MAX_AGE)
+    return response
+
+
+def swagger_ui(request, *args, **kwargs):
+    """
+    Swagger UI page. It loads the spec from `schema_json` (SWAGGER_SETTINGS['SPEC_URL']),
+    so rendering the page itself does no introspection.
+    """
+    global _ui_view
+    if _ui_view is None:
+        from drf_yasg import openapi
+        from drf_yasg.generators import OpenAPISchemaGenerator
+        from drf_yasg.views import get_schema_view
+
+        class InfoOnlyGenerator(OpenAPISchemaGenerator):
+            def get_schema(self, request=None, public=False):
+                return openapi.Swagger(info=self.info, _prefix='/', paths=openapi.Paths(paths={}))
+
+        _ui_view = get_schema_view(
+            openapi.Info(**SCHEMA_INFO),
+            public=True,
+            generator_class=InfoOnlyGenerator,
+        ).with_ui('swagger', cache_timeout=settings.OPENAPI_SCHEMA_MAX_AGE)
+    return _ui_view(request, *args, **kwargs)
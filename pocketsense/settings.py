@@ -55,6 +55,8 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'core.middleware.ThrottleHeadersMiddleware',
+    'core.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'pocketsense.urls'
@@ -90,10 +92,100 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
+    'DEFAULT_THROTTLE_CLASSES': [
+        'core.throttling.UserCostThrottle',
+        'core.throttling.RouteCostThrottle',
+    ],
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Shared by every process so throttle buckets hold across workers. Needs the redis package;
+    # without it, or while Redis is down, buckets are kept per process
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+    },
+}
+
+# Token bucket throttling: buckets hold `capacity` tokens and refill at `refill_rate` tokens per second
+THROTTLE_CACHE_ALIAS = 'throttle'
+THROTTLE_BUCKETS = {
+    'user': {'capacity': 300, 'refill_rate': 5},
+    'route': {'capacity': 60, 'refill_rate': 0.5},
+}
+# Tokens taken per request by URL name; unlisted routes cost 1 and only use the user bucket
+THROTTLE_COSTS = {
+    'monthly-analysis': 10,
+    'spending-trends': 10,
+    'groups-expenses': 5,
+    'expenses-bulk': 20,
+    'settlements-reminder': 20,
+    'settlement-reminder': 20,
 }
 
 CORS_ALLOW_ALL_ORIGINS = True
 
+# Seconds to cache computed spending trends per (group, month range)
+ANALYTICS_CACHE_TIMEOUT = 300
+# Longest month range /analysis/trends/ covers in one request
+ANALYTICS_MAX_MONTHS = 120
+
+# Default age in days after which `manage.py archive` moves closed rows to the archive tables
+ARCHIVE_AFTER_DAYS = 365
+
+# Pub/sub backend fanning out live group events to /api/groups/<id>/events/ streams
+EVENTS_BACKEND = 'core.events.InProcessBackend'
+EVENTS_BACKEND_OPTIONS = {'queue_size': 100}
+EVENTS_HEARTBEAT_SECONDS = 15
+
+# Delta sync (/api/sync/): rows per stream per page, and how long recent changes are held back
+SYNC_PAGE_SIZE = 200
+SYNC_SAFETY_WINDOW_SECONDS = 2
+# Tombstones and join records are kept this long (`manage.py prune_sync`); older tokens get 410
+SYNC_RETENTION_DAYS = 90
+
+# Rows deleted per transaction by `manage.py purge_deleted`
+DELETION_BATCH_SIZE = 500
+
+# Payment reminders queued from the admin and sent by `manage.py process_reminders`: reminders per
+# batch, sends per reminder, seconds before the first retry (doubling after each failure) and how
+# long a claimed batch may stay running before another worker takes it over
+REMINDER_BATCH_SIZE = 100
+REMINDER_MAX_ATTEMPTS = 5
+REMINDER_RETRY_DELAY = 60
+REMINDER_LEASE_SECONDS = 600
+
+# Monthly statements: rendered files (served only through the authenticated download endpoint, so
+# kept outside MEDIA_ROOT), jobs per worker batch, render processes (None = CPU count), how long a
+# claimed job may stay running before another worker takes it over and how many times it is tried
+STATEMENT_DIR = BASE_DIR / 'statements'
+STATEMENT_BATCH_SIZE = 50
+STATEMENT_WORKERS = None
+STATEMENT_LEASE_SECONDS = 1800
+STATEMENT_MAX_ATTEMPTS = 3
+
+# Request profiling: requests with a signed X-Profile header (`manage.py profile_token`)
+# or a random sample are profiled, keeping the newest PROFILING_MAX_ENTRIES profiles
+PROFILING_SAMPLE_RATE = 0.0
+PROFILING_TOKEN_MAX_AGE = 3600
+PROFILING_DIR = BASE_DIR / 'profiles'
+PROFILING_MAX_ENTRIES = 200
+PROFILING_SLOW_QUERIES = 10
+PROFILING_EXPLAIN_QUERIES = 3
+
+# Precomputed OpenAPI schema, written by `manage.py generate_schema` or on first request.
+# The file name gets a fingerprint of OPENAPI_SCHEMA_SOURCES (openapi-<fingerprint>.json)
+OPENAPI_SCHEMA_PATH = BASE_DIR / 'openapi.json'
+OPENAPI_SCHEMA_SOURCES = ['core.models', 'core.serializers', 'core.views', 'pocketsense.urls']
+OPENAPI_SCHEMA_MAX_AGE = 3600
+
+SWAGGER_SETTINGS = {
+    'SPEC_URL': 'schema-json',
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -21,8 +21,8 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
 )
 from rest_framework.routers import DefaultRouter
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
+
+from pocketsense.schema import schema_json, swagger_ui
 
 from core.views import (
     StudentViewSet,
@@ -31,19 +31,13 @@ from core.views import (
     SettlementViewSet,
     CategoryViewSet,
     MonthlyAnalysisViewSet,
-
+    SpendingTrendsViewSet,
+    SyncViewSet,
+    StatementJobViewSet,
+    group_events,
 )
 
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="PocketSense API",
-        default_version='v1',
-        description="API documentation for PocketSense",
-    ),
-    public=True,
-)
-
 # Define API routes using DefaultRouter
 router = DefaultRouter()
 router.register(r'students', StudentViewSet, basename='students')
@@ -51,14 +45,18 @@ router.register(r'groups', GroupViewSet, basename='groups')
 router.register(r'expenses', ExpenseViewSet, basename='expenses')
 router.register(r'settlements', SettlementViewSet, basename='settlements')
 router.register(r'categories', CategoryViewSet, basename='categories')
+router.register(r'statements', StatementJobViewSet, basename='statements')
 
 # URL patterns
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/groups/<int:pk>/events/', group_events, name='group-events'),  # Live group updates (SSE, ASGI only)
     path('api/', include(router.urls)),  # Include all router-registered routes
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
-    path('docs/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'), # Swagger docs
+    path('api/sync/', SyncViewSet.as_view({'get': 'list'}), name='sync'),  # Delta sync since a token
+    path('docs/', swagger_ui, name='schema-swagger-ui'), # Swagger docs
+    path('docs/openapi.json', schema_json, name='schema-json'),  # Precomputed OpenAPI schema
 
     # Custom URLs for additional functionality
     #path('expenses/', ExpenseViewSet.as_view({'post': 'create'}), name='expense-create'),  # Create expense
@@ -66,4 +64,5 @@ urlpatterns = [
     #path('settlements/', SettlementViewSet.as_view({'get': 'list'}), name='settlement-list'),  # List settlements
     path('settlements/<int:pk>/reminder/', SettlementViewSet.as_view({'post': 'reminder'}), name='settlement-reminder'),  # Payment reminder
     path('analysis/monthly/', MonthlyAnalysisViewSet.as_view({'get': 'list'}), name='monthly-analysis'),  # Monthly analysis
+    path('analysis/trends/', SpendingTrendsViewSet.as_view({'get': 'list'}), name='spending-trends'),  # Spending trends and anomalies
 ]